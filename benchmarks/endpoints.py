@@ -0,0 +1,365 @@
+"""
+Load test and micro benchmark of the endpoints in src/main.py.
+
+Seeds a local database with synthetic users, planets, characters and favorites, then drives
+/login, /get-favorites, /update-favorites and /load_data through the Flask test client and
+through a real threaded WSGI server or uvicorn serving src/asgi.py, and reports p50/p95/p99 latency, requests per second
+and SQL statements per request. SWAPI is replaced by generated fixture pages.
+
+    python benchmarks/endpoints.py --users 10000 --favorites 100 --output results.json
+    python benchmarks/endpoints.py --database postgresql://localhost/bench --driver wsgi
+    python benchmarks/endpoints.py --driver wsgi --driver asgi --concurrency 64 (needs uvicorn)
+    python benchmarks/endpoints.py --baseline results.json --max-regression 0.2
+
+With --baseline the run exits with status 1 when the p95 of any scenario is more than
+--max-regression slower than in the baseline file, so CI can flag regressions.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+BENCHMARK_PASSWORD = "benchmark-password"
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------SWAPI stub
+def write_swapi_fixtures(directory, planets, characters, page_size=10):
+    """Writes <resource>-<page>.json pages shaped like the swapi.dev responses."""
+    resources = {
+        "planets": [
+            {"url": "https://swapi.dev/api/planets/%d/" % index, "name": "Planet %d" % index,
+             "climate": random.choice(("arid", "temperate", "frozen", "murky")), "population": str(index * 1000),
+             "terrain": random.choice(("desert", "grasslands, mountains", "jungle", "ocean")),
+             "rotation_period": "24", "orbital_period": "364", "diameter": "12500", "surface_water": "40"}
+            for index in range(1, planets + 1)
+        ],
+        "people": [
+            {"url": "https://swapi.dev/api/people/%d/" % index, "name": "Character %d" % index,
+             "birth_year": "19BBY", "gender": random.choice(("male", "female", "n/a")), "height": "172",
+             "skin_color": "fair", "eye_color": "blue", "hair_color": "blond",
+             "homeworld": "https://swapi.dev/api/planets/%d/" % random.randint(1, planets)}
+            for index in range(1, characters + 1)
+        ],
+    }
+    for resource, items in resources.items():
+        for page, start in enumerate(range(0, len(items), page_size), start=1):
+            with open(os.path.join(directory, "%s-%d.json" % (resource, page)), "w") as fixture:
+                json.dump({"count": len(items), "results": items[start:start + page_size]}, fixture)
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Seeding
+def seed_database(app, users, favorites, planets, characters, batch_size=5000):
+    from sqlalchemy import insert
+    from models import db, User, Planet, Character, FavoritePlanet, FavoriteCharacter
+    from initialLoad import initial_loader
+    from catalog import reload_catalog
+    from passwords import hash_password
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        initial_loader()
+        #* Every synthetic user shares one hash, seeding 10k users should not cost 10k hashes
+        password_hash = hash_password(BENCHMARK_PASSWORD)
+        for start in range(1, users + 1, batch_size):
+            db.session.execute(insert(User), [
+                {"id": user_id, "username": "user%d" % user_id, "email": "user%d@example.com" % user_id,
+                 "password": password_hash, "is_active": True}
+                for user_id in range(start, min(start + batch_size, users + 1))
+            ])
+        planet_favorites = favorites // 2
+        character_favorites = favorites - planet_favorites
+        for model, column, count, catalog_size in (
+            (FavoritePlanet, "planet_id", planet_favorites, planets),
+            (FavoriteCharacter, "character_id", character_favorites, characters),
+        ):
+            rows = []
+            for user_id in range(1, users + 1):
+                for item in random.sample(range(1, catalog_size + 1), min(count, catalog_size)):
+                    rows.append({"user_id": user_id, column: item})
+                if len(rows) >= batch_size:
+                    db.session.execute(insert(model), rows)
+                    rows = []
+            if rows:
+                db.session.execute(insert(model), rows)
+        db.session.commit()
+        reload_catalog()
+
+
+def access_tokens(app, users, count):
+    from flask_jwt_extended import create_access_token
+    from auth import TokenIdentity, identity_claims
+    with app.app_context():
+        tokens = {}
+        for user_id in random.sample(range(1, users + 1), min(count, users)):
+            identity = TokenIdentity(user_id, "user%d" % user_id, "user%d@example.com" % user_id)
+            tokens[user_id] = create_access_token(identity=identity, additional_claims=identity_claims(identity))
+        return tokens
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Drivers
+class TestClientDriver:
+    name = "test_client"
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, headers=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json_body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        pass
+
+
+class WsgiServerDriver:
+    """Serves the app with werkzeug's threaded server on a free port and calls it over HTTP."""
+    name = "wsgi"
+
+    def __init__(self, app):
+        import requests
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self._requests = requests
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, headers=None):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, json=json_body, headers=headers)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+    def close(self):
+        self.server.shutdown()
+
+
+class AsgiServerDriver(WsgiServerDriver):
+    """Serves src/asgi.py with uvicorn on a free port, the requests go over HTTP like the wsgi driver."""
+    name = "asgi"
+
+    def __init__(self, app):
+        import asyncio
+        import socket
+        import requests
+        import uvicorn
+        from asgi_adapter import WSGIAdapter
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.base_url = "http://127.0.0.1:%d" % self.socket.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(WSGIAdapter(app), log_level="error", lifespan="on"))
+        #* Signals belong to the main thread, which runs the benchmark
+        self.server.install_signal_handlers = lambda: None
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.server.serve(sockets=[self.socket])), daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self._requests = requests
+        self._local = threading.local()
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+DRIVERS = {driver.name: driver for driver in (TestClientDriver, WsgiServerDriver, AsgiServerDriver)}
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Scenarios
+def scenario_requests(name, args, tokens):
+    """Returns a function that builds the (method, path, json, headers) of the next request."""
+    user_ids = list(tokens)
+
+    def auth_headers(user_id):
+        return {"Authorization": "Bearer " + tokens[user_id]}
+
+    if name == "login":
+        return lambda: ("POST", "/login", {"username": "user%d" % random.randint(1, args.users), "password": BENCHMARK_PASSWORD}, None)
+    if name == "get_favorites":
+        return lambda: ("GET", "/get-favorites", None, auth_headers(random.choice(user_ids)))
+    if name == "update_favorites":
+        def update_favorites():
+            payload = [{"category": "PLANET", "planet_id": item} for item in random.sample(range(1, args.planets + 1), args.favorites // 2)]
+            payload += [{"category": "CHARACTER", "character_id": item} for item in random.sample(range(1, args.characters + 1), args.favorites - args.favorites // 2)]
+            return "POST", "/update-favorites", payload, auth_headers(random.choice(user_ids))
+        return update_favorites
+    if name == "load_data":
+        return lambda: ("POST", "/load_data", None, None)
+    raise ValueError("Unknown scenario %s" % name)
+
+
+def wait_for_load(driver, body, timeout=120):
+    #* /load_data answers right away, the job itself is part of what the scenario measures
+    if not body or "status_url" not in body:
+        return
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, job = driver.request("GET", body["status_url"])
+        if job and job.get("status") not in ("queued", "running"):
+            return
+        time.sleep(0.01)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(driver, name, request_count, concurrency, next_request):
+    from instrumentation import metrics
+    endpoint = {"login": "api.login", "get_favorites": "api.get_favorites",
+                "update_favorites": "api.update_favorites_sm", "load_data": "loader.load_data"}[name]
+    queries_before = metrics.histogram_totals("http_request_sql_statements", endpoint=endpoint)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    #* The load job keeps one load at a time, so that scenario always runs sequentially
+    workers = 1 if name == "load_data" else concurrency
+
+    def worker(count):
+        nonlocal errors
+        for _ in range(count):
+            method, path, json_body, headers = next_request()
+            started = time.perf_counter()
+            status, body = driver.request(method, path, json_body, headers)
+            if name == "load_data":
+                wait_for_load(driver, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        share, remainder = divmod(request_count, workers)
+        list(executor.map(worker, [share + (1 if index < remainder else 0) for index in range(workers)]))
+    wall_time = time.perf_counter() - started
+
+    queries_after = metrics.histogram_totals("http_request_sql_statements", endpoint=endpoint)
+    handled = queries_after[0] - queries_before[0]
+    latencies.sort()
+    return {
+        "scenario": name,
+        "driver": driver.name,
+        "requests": len(latencies),
+        "concurrency": workers,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        "requests_per_second": round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+        "queries_per_request": round((queries_after[1] - queries_before[1]) / handled, 2) if handled else None,
+    }
+
+
+def compare_with_baseline(results, baseline_file, max_regression):
+    with open(baseline_file) as baseline:
+        baseline_results = {(result["scenario"], result["driver"]): result for result in json.load(baseline)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["scenario"], result["driver"]))
+        if previous and previous["p95_ms"] and result["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append("%s/%s p95 %.2fms -> %.2fms" % (result["scenario"], result["driver"], previous["p95_ms"], result["p95_ms"]))
+    return regressions
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Main
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLAlchemy url, defaults to a SQLite file in a temporary directory")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user, half planets and half characters")
+    parser.add_argument("--planets", type=int, default=200)
+    parser.add_argument("--characters", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="login hashes on purpose, so it gets fewer requests")
+    parser.add_argument("--load-requests", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--driver", action="append", choices=tuple(DRIVERS))
+    parser.add_argument("--scenario", action="append", choices=("login", "get_favorites", "update_favorites", "load_data"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="flask-endpoints-bench-")
+    fixture_dir = os.path.join(workdir, "swapi")
+    os.makedirs(fixture_dir)
+    write_swapi_fixtures(fixture_dir, args.planets, args.characters)
+
+    #* The app reads its configuration at import time
+    os.environ["DB_CONNECTION_STRING"] = args.database or "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ["SWAPI_FIXTURE_DIR"] = fixture_dir
+    os.environ.setdefault("FLASK_APP_KEY", "benchmark key")
+    #* The scenarios are bursts on purpose, the limits would turn most of them into 429s
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    sys.path.insert(0, SRC_DIR)
+    from main import app
+
+    started = time.perf_counter()
+    seed_database(app, args.users, args.favorites, args.planets, args.characters)
+    print("Seeded %d users with %d favorites each in %.1fs" % (args.users, args.favorites, time.perf_counter() - started))
+    tokens = access_tokens(app, args.users, 1000)
+
+    request_counts = {"login": args.login_requests, "load_data": args.load_requests}
+    results = []
+    for driver_name in args.driver or ("test_client", "wsgi"):
+        driver = DRIVERS[driver_name](app)
+        try:
+            for name in args.scenario or ("login", "get_favorites", "update_favorites", "load_data"):
+                result = run_scenario(driver, name, request_counts.get(name, args.requests), args.concurrency, scenario_requests(name, args, tokens))
+                results.append(result)
+                print("%-12s %-17s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %8.1f req/s  %s queries/req  %d errors" % (
+                    result["driver"], result["scenario"], result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                    result["requests_per_second"], result["queries_per_request"], result["errors"]))
+        finally:
+            driver.close()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "database": os.environ["DB_CONNECTION_STRING"].split("://", 1)[0],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Logins per second per core for each password hashing parameter set, used to size the dynos.
+
+    python benchmarks/login_throughput.py
+    python benchmarks/login_throughput.py --method pbkdf2:sha256:600000 --method scrypt:32768:8:1 --threads 4
+
+Each method is measured single threaded (one core) and with --threads concurrent verifications,
+which shows whether the hash releases the GIL and scales across the cores of one worker.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from passwords import hash_password, verify_password  # noqa: E402
+
+DEFAULT_METHODS = ("pbkdf2:sha256:260000", "pbkdf2:sha256:600000", "scrypt:16384:8:1", "scrypt:32768:8:1")
+
+
+def verifications_per_second(stored_password, password, duration, threads):
+    deadline = time.perf_counter() + duration
+
+    def run():
+        done = 0
+        while time.perf_counter() < deadline:
+            verify_password(stored_password, password)
+            done += 1
+        return done
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(lambda _: run(), range(threads)))
+    return total / (time.perf_counter() - started)
+
+
+def benchmark(method, duration, threads):
+    stored_password = hash_password("correct horse battery staple", method=method)
+    single = verifications_per_second(stored_password, "correct horse battery staple", duration, 1)
+    parallel = verifications_per_second(stored_password, "correct horse battery staple", duration, threads)
+    return {
+        "method": method,
+        "hash_length": len(stored_password),
+        "ms_per_login": round(1000 / single, 2),
+        "logins_per_second_per_core": round(single, 1),
+        "logins_per_second_%d_threads" % threads: round(parallel, 1),
+        "thread_scaling": round(parallel / single, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", action="append", help="werkzeug hash method, can be repeated")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per measurement")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for method in args.method or DEFAULT_METHODS:
+        try:
+            result = benchmark(method, args.duration, args.threads)
+        except ValueError as error:
+            #* scrypt needs werkzeug >= 2.3 and an OpenSSL build with scrypt
+            print("%-24s skipped: %s" % (method, error))
+            continue
+        results.append(result)
+        print("%-24s %8.2f ms/login %8.1f logins/s/core %8.1f logins/s on %d threads" % (
+            method, result["ms_per_login"], result["logins_per_second_per_core"],
+            result["logins_per_second_%d_threads" % args.threads], args.threads))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"cpu_count": os.cpu_count(), "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Latency of GET /search against the SQL LIKE query it replaces.
+
+Seeds a database with synthetic planets and characters, loads the catalog (which builds the search index)
+and times every query four ways:
+- index: SearchIndex.search alone
+- handler: the /search view inside a request context with its response cache emptied before every call
+- handler_cached: the same view answering from the response cache
+- sql_like: the ILIKE '%word%' query over the same fields, every word ANDed, planets and characters
+
+The SQL query does not rank anything and its LIMIT stops at the first rows that match, so a word most of the
+catalog contains is its best case and a rare word or a word nothing contains (a full scan) its worst.
+
+    python benchmarks/search_latency.py
+    python benchmarks/search_latency.py --planets 5000 --characters 20000 --query desert --query "sky wal"
+    python benchmarks/search_latency.py --database postgresql://localhost/bench --output search.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+DEFAULT_QUERIES = ("desert", "Sky", "sky wal", "s", "frozen tundra", "blue eyes", "zzz")
+SYLLABLES = ("ta", "too", "ine", "sky", "ho", "th", "ja", "kku", "walk", "er", "da", "go", "bah", "na", "boo",
+             "cor", "us", "cant", "kes", "lu", "ke", "an", "a", "kin", "rey", "fin", "po", "dam", "ob", "i", "wan")
+TERRAINS = ("desert", "grasslands", "mountains", "jungle", "rainforests", "tundra", "ice caves", "swamp",
+            "gas giant", "ocean", "cityscape", "forests", "lakes", "sky dunes", "volcanoes", "plains")
+CLIMATES = ("arid", "temperate", "tropical", "frozen", "murky", "hot", "humid", "windy", "polluted")
+COLORS = ("blue", "brown", "black", "blond", "red", "fair", "light", "dark", "green", "grey", "white", "hazel", "yellow")
+GENDERS = ("male", "female", "n/a", "hermaphrodite")
+
+
+def synthetic_name():
+    return " ".join("".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))).capitalize()
+                    for _ in range(random.choice((1, 1, 2))))
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Seeding
+def seed_catalog(app, planets, characters):
+    from sqlalchemy import insert
+    from models import db, Planet, Character
+    from catalog import reload_catalog
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Planet), [
+            {"local_id": local_id, "name": synthetic_name(), "climate": ", ".join(random.sample(CLIMATES, random.randint(1, 2))),
+             "terrain": ", ".join(random.sample(TERRAINS, random.randint(1, 3))), "population": str(local_id * 1000)}
+            for local_id in range(1, planets + 1)
+        ])
+        db.session.execute(insert(Character), [
+            {"local_id": local_id, "name": synthetic_name(), "gender": random.choice(GENDERS),
+             "hair_color": random.choice(COLORS), "skin_color": random.choice(COLORS), "eye_color": random.choice(COLORS)}
+            for local_id in range(1, characters + 1)
+        ])
+        db.session.commit()
+        reload_catalog()
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Measurements
+def like_statement(query, limit):
+    """What /search would run without the index, the same fields and the same AND of the words."""
+    from sqlalchemy import select, literal, and_, or_, union_all
+    from models import Planet, Character
+    from search import SEARCH_FIELDS, words
+
+    statements = []
+    for category, model in (("planets", Planet), ("characters", Character)):
+        conditions = [or_(*(getattr(model, field).ilike("%" + word + "%") for field in SEARCH_FIELDS[category]))
+                      for word in words(query)]
+        statements.append(select(literal(category).label("type"), model.local_id, model.name).where(and_(*conditions)))
+    return union_all(*statements).limit(limit)
+
+
+def timed(function, iterations, before=None):
+    samples = []
+    for _ in range(iterations):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "p50_us": round(statistics.median(samples), 1),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        "mean_us": round(statistics.fmean(samples), 1),
+    }
+
+
+def measure(app, query, iterations, limit):
+    from models import db
+    from search import search_index, search_results, search_response
+
+    path = "/search?" + urlencode({"q": query, "limit": limit})
+    results = {}
+    with app.app_context():
+        results["index"] = timed(lambda: search_index.search(query, limit=limit), iterations)
+        with app.test_request_context(path):
+            results["handler"] = timed(search_response, iterations, before=search_results.clear)
+            results["handler_cached"] = timed(search_response, iterations)
+        statement = like_statement(query, limit)
+        results["sql_like"] = timed(lambda: db.session.execute(statement).all(), iterations)
+        matches = len(search_index.search(query, limit=limit)), len(db.session.execute(statement).all())
+    return results, matches
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Main
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLAlchemy url, defaults to a SQLite file in a temporary directory")
+    parser.add_argument("--planets", type=int, default=2000)
+    parser.add_argument("--characters", type=int, default=5000)
+    parser.add_argument("--query", action="append", help="query to time, can be repeated")
+    parser.add_argument("--iterations", type=int, default=500, help="calls per query and method")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="flask-endpoints-search-")
+
+    #* The app reads its configuration at import time
+    os.environ["DB_CONNECTION_STRING"] = args.database or "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("FLASK_APP_KEY", "benchmark key")
+    sys.path.insert(0, SRC_DIR)
+    from main import app
+    from search import search_index
+
+    started = time.perf_counter()
+    seed_catalog(app, args.planets, args.characters)
+    print("Seeded %d planets and %d characters, index built in %.1fs: %s" % (
+        args.planets, args.characters, time.perf_counter() - started, search_index.stats()))
+
+    results = []
+    for query in args.query or DEFAULT_QUERIES:
+        timings, (index_matches, sql_matches) = measure(app, query, args.iterations, args.limit)
+        results.append({"query": query, "index_matches": index_matches, "sql_matches": sql_matches, **timings})
+        print("%-16r %s  sql/handler x%.0f" % (query, "  ".join(
+            "%s p50 %7.1fus p95 %7.1fus" % (method, timings[method]["p50_us"], timings[method]["p95_us"])
+            for method in ("index", "handler", "handler_cached", "sql_like")),
+            timings["sql_like"]["p50_us"] / max(timings["handler"]["p50_us"], 0.1)))
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "database": os.environ["DB_CONNECTION_STRING"].split("://", 1)[0],
+        "index": search_index.stats(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""background job heartbeat
+
+Revision ID: a8c3e5f1b946
+Revises: f6a1d3c8b527
+Create Date: 2026-10-18 21:12:37.604512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c3e5f1b946'
+down_revision = 'f6a1d3c8b527'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('background_job') as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('background_job') as batch_op:
+        batch_op.drop_column('updated_at')
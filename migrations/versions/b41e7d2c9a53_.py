@@ -0,0 +1,36 @@
+"""unique favorites per user
+
+Revision ID: b41e7d2c9a53
+Revises: 70182625f16d
+Create Date: 2026-10-18 09:12:44.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41e7d2c9a53'
+down_revision = '70182625f16d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of every duplicated favorite so the unique indexes can be created.
+    # The derived table is needed by MySQL, which can not select from the table it deletes from.
+    op.execute(
+        "DELETE FROM favorite_planet WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MIN(id) AS id FROM favorite_planet GROUP BY user_id, planet_id) AS keep_planet)"
+    )
+    op.execute(
+        "DELETE FROM favorite_character WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MIN(id) AS id FROM favorite_character GROUP BY user_id, character_id) AS keep_character)"
+    )
+    op.create_index('ix_favorite_planet_user_id_planet_id', 'favorite_planet', ['user_id', 'planet_id'], unique=True)
+    op.create_index('ix_favorite_character_user_id_character_id', 'favorite_character', ['user_id', 'character_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_favorite_character_user_id_character_id', table_name='favorite_character')
+    op.drop_index('ix_favorite_planet_user_id_planet_id', table_name='favorite_planet')
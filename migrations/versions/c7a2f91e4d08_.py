@@ -0,0 +1,26 @@
+"""widen user.password for hashes
+
+Revision ID: c7a2f91e4d08
+Revises: b41e7d2c9a53
+Create Date: 2026-10-18 10:03:27.540913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a2f91e4d08'
+down_revision = 'b41e7d2c9a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=80), type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=255), type_=sa.String(length=80), existing_nullable=False)
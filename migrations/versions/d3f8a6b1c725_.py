@@ -0,0 +1,26 @@
+"""favorites version per user
+
+Revision ID: d3f8a6b1c725
+Revises: c7a2f91e4d08
+Create Date: 2026-10-18 11:21:09.337465
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8a6b1c725'
+down_revision = 'c7a2f91e4d08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('favorites_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('favorites_version')
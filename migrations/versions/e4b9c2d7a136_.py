@@ -0,0 +1,26 @@
+"""favorites last modified time per user
+
+Revision ID: e4b9c2d7a136
+Revises: d3f8a6b1c725
+Create Date: 2026-10-18 16:02:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9c2d7a136'
+down_revision = 'd3f8a6b1c725'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('favorites_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('favorites_updated_at')
@@ -0,0 +1,36 @@
+"""background jobs shared by every worker
+
+Revision ID: f6a1d3c8b527
+Revises: e4b9c2d7a136
+Create Date: 2026-10-18 18:40:12.804117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6a1d3c8b527'
+down_revision = 'e4b9c2d7a136'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('background_job',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('lock_key', sa.String(length=50), nullable=True),
+    sa.Column('progress', sa.JSON(), nullable=True),
+    sa.Column('errors', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('lock_key')
+    )
+
+
+def downgrade():
+    op.drop_table('background_job')
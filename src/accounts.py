@@ -0,0 +1,285 @@
+"""
+Bulk account provisioning, used by POST /accounts/bulk and `flask users import`.
+POST /accounts/bulk copies the body to a temporary file and imports it as a background job, see jobs.py,
+so hashing the passwords of a large upload never holds a request worker; the client polls /accounts/bulk/<job_id>.
+The input (a JSON array, NDJSON or CSV with username, email and password columns) is read as a stream and
+handled in chunks of ACCOUNT_IMPORT_CHUNK rows: each chunk is validated, checked against the existing users
+with two queries, hashed on a process pool and inserted with one multi-row INSERT, then committed.
+Rows that fail are listed in the report with their row number and the reason, the other rows are created.
+The hashing processes are shut down at the end of every import, they are only started again by the next one.
+Rows can carry a password_hash (werkzeug format, e.g. from the tenant being migrated) instead of a password,
+those are stored as they are and skip the hashing, which is what makes large imports fast.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+from passwords import hash_password, hash_method
+from utils import APIException
+from jobs import JobRunner
+
+ACCOUNT_IMPORT_CHUNK = int(os.environ.get('ACCOUNT_IMPORT_CHUNK', 1000))
+ACCOUNT_IMPORT_WORKERS = int(os.environ.get('ACCOUNT_IMPORT_WORKERS', os.cpu_count() or 1))
+IMPORT_FORMATS = ("json", "ndjson", "csv")
+MAX_FIELD_LENGTH = 120
+#* Failed rows listed by the status of an import job, the count covers all of them
+IMPORT_STATUS_ERRORS = 1000
+
+_hash_pool = None
+
+
+def hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        #* spawn, forking a process that runs threads (request workers, the password pool) is not safe
+        _hash_pool = ProcessPoolExecutor(max_workers=ACCOUNT_IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _hash_pool
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown()
+        _hash_pool = None
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def fail(self, row_number, row, error):
+        self.errors.append({
+            "row": row_number,
+            "username": row.get("username") if isinstance(row, dict) else None,
+            "email": row.get("email") if isinstance(row, dict) else None,
+            "error": error,
+        })
+
+    def to_dict(self):
+        #* Rows rejected by validation are reported before the ones rejected by the database, sort them back
+        return {"created": self.created, "failed": len(self.errors), "errors": sorted(self.errors, key=lambda error: error["row"])}
+
+
+class ImportProgress(ImportReport):
+    """Report of an import job, its failed rows are named failed_rows since errors holds the errors of the job itself."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows_read = 0
+
+    def to_dict(self):
+        report = ImportReport.to_dict(self)
+        return {"rows_read": self.rows_read, "created": report["created"], "failed": report["failed"],
+                "failed_rows": report["errors"][:IMPORT_STATUS_ERRORS]}
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Input
+def read_rows(stream, import_format):
+    """Yields the rows of a binary stream one at a time, only a JSON array is read at once."""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if import_format == "csv":
+        yield from csv.DictReader(text)
+    elif import_format == "ndjson":
+        for line in text:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+    else:
+        try:
+            rows = json.load(text)
+        except ValueError:
+            raise APIException("The body is not valid JSON", status_code=400)
+        if not isinstance(rows, list):
+            raise APIException("The body must be a list of accounts", status_code=400)
+        yield from rows
+
+
+def format_from_mimetype(mimetype):
+    return {"text/csv": "csv", "application/x-ndjson": "ndjson"}.get(mimetype, "json")
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Validation
+def validation_error(row):
+    if not isinstance(row, dict):
+        return "not an object"
+    for field in ("username", "email"):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return "empty %s" % field
+        if len(value) > MAX_FIELD_LENGTH:
+            return "%s longer than %d characters" % (field, MAX_FIELD_LENGTH)
+    if "@" not in row["email"]:
+        return "invalid email"
+    if row.get("password_hash"):
+        if hash_method(row["password_hash"]) is None:
+            return "password_hash is not a supported hash"
+    elif not isinstance(row.get("password"), str) or not row["password"]:
+        return "empty password"
+    return None
+
+
+def existing_values(column, values):
+    return set(db.session.execute(select(column).where(column.in_(values))).scalars())
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Import
+def import_chunk(chunk, first_row_number, report, seen_usernames, seen_emails):
+    candidates = []
+    for offset, row in enumerate(chunk):
+        row_number = first_row_number + offset
+        error = validation_error(row)
+        if error is None:
+            row = {"username": row["username"].strip(), "email": row["email"].strip(),
+                   "password": row.get("password"), "password_hash": row.get("password_hash")}
+            if row["username"] in seen_usernames:
+                error = "username repeated in the import"
+            elif row["email"] in seen_emails:
+                error = "email repeated in the import"
+        if error is not None:
+            report.fail(row_number, row, error)
+            continue
+        seen_usernames.add(row["username"])
+        seen_emails.add(row["email"])
+        candidates.append((row_number, row))
+    if not candidates:
+        return
+
+    #* Two queries per chunk find the rows that collide with existing users
+    taken_usernames = existing_values(User.username, [row["username"] for _, row in candidates])
+    taken_emails = existing_values(User.email, [row["email"] for _, row in candidates])
+    accepted = []
+    for row_number, row in candidates:
+        if row["username"] in taken_usernames:
+            report.fail(row_number, row, "username already taken")
+        elif row["email"] in taken_emails:
+            report.fail(row_number, row, "email already taken")
+        else:
+            accepted.append((row_number, row))
+
+    plaintext = [row["password"] for _, row in accepted if not row["password_hash"]]
+    if plaintext:
+        hashes = iter(hash_pool().map(hash_password, plaintext, chunksize=max(1, len(plaintext) // (ACCOUNT_IMPORT_WORKERS * 4))))
+        for _, row in accepted:
+            if not row["password_hash"]:
+                row["password_hash"] = next(hashes)
+    insert_accounts(accepted, report)
+
+
+def account_values(row):
+    return {"username": row["username"], "email": row["email"], "password": row["password_hash"], "is_active": True}
+
+
+def insert_accounts(accepted, report):
+    if not accepted:
+        return
+    try:
+        db.session.execute(insert(User), [account_values(row) for _, row in accepted])
+        db.session.commit()
+        report.created += len(accepted)
+        return
+    except IntegrityError:
+        db.session.rollback()
+    #* A concurrent signup took a username or email after the check, the chunk is retried row by row to find it
+    for row_number, row in accepted:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(User), [account_values(row)])
+            report.created += 1
+        except IntegrityError:
+            report.fail(row_number, row, "username or email already taken")
+    db.session.commit()
+
+
+def import_accounts(rows, chunk_size=ACCOUNT_IMPORT_CHUNK, on_chunk=None, report=None):
+    """Creates the accounts of an iterable of row dicts and returns the ImportReport, a new one unless report is given."""
+    report = report if report is not None else ImportReport()
+    seen_usernames = set()
+    seen_emails = set()
+    row_number = 1
+    try:
+        for chunk in chunked(rows, chunk_size):
+            import_chunk(chunk, row_number, report, seen_usernames, seen_emails)
+            row_number += len(chunk)
+            if on_chunk is not None:
+                on_chunk(row_number - 1, report)
+    finally:
+        #* Idle hashing processes would keep their memory for the life of the worker
+        shutdown_hash_pool()
+    return report
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Job
+def spool_upload(stream, import_format):
+    """Copies a request body to a temporary file and returns its path, the import job reads it after the response."""
+    with tempfile.NamedTemporaryFile("wb", prefix="accounts-import-", suffix="." + import_format, delete=False) as spool:
+        shutil.copyfileobj(stream, spool)
+    return spool.name
+
+
+def run_import(progress, path, import_format):
+    def on_chunk(rows_read, report):
+        progress.rows_read = rows_read
+
+    try:
+        with open(path, "rb") as stream:
+            import_accounts(read_rows(stream, import_format), on_chunk=on_chunk, report=progress)
+    except APIException as error:
+        #* The job lists "<exception class>: <str(exception)>", an APIException only has its message
+        raise ValueError(error.message)
+    finally:
+        os.remove(path)
+
+
+import_jobs = JobRunner("accounts_import", run_import, ImportProgress)
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------CLI
+users_cli = AppGroup("users", help="Manage user accounts.")
+
+@users_cli.command("import")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "import_format", type=click.Choice(IMPORT_FORMATS), help="Guessed from the file extension by default")
+@click.option("--report", "report_file", type=click.Path(dir_okay=False), help="Write the full report as JSON to this file")
+@click.option("--chunk-size", type=int, default=ACCOUNT_IMPORT_CHUNK, show_default=True)
+def import_users_command(source, import_format, report_file, chunk_size):
+    import_format = import_format or os.path.splitext(source)[1].lstrip(".").lower()
+    if import_format not in IMPORT_FORMATS:
+        raise click.UsageError("Use --format, the extension of %s is not one of %s" % (source, ", ".join(IMPORT_FORMATS)))
+
+    def progress(rows_read, report):
+        click.echo("%d rows read, %d created, %d failed" % (rows_read, report.created, len(report.errors)), err=True)
+
+    with open(source, "rb") as stream:
+        try:
+            report = import_accounts(read_rows(stream, import_format), chunk_size, on_chunk=progress)
+        except APIException as error:
+            raise click.ClickException(error.message)
+    if report_file:
+        with open(report_file, "w") as output:
+            json.dump(report.to_dict(), output, indent=2)
+    for error in report.errors[:20]:
+        click.echo("row %(row)d %(username)s <%(email)s>: %(error)s" % error, err=True)
+    click.echo("Created %d accounts, %d rows failed" % (report.created, len(report.errors)))
@@ -1,10 +1,8 @@
-import os
 from flask_admin import Admin
 from models import db, User,Character, Planet, FavoritePlanet, FavoriteCharacter
 from flask_admin.contrib.sqla import ModelView
 
 def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
@@ -0,0 +1,11 @@
+"""
+ASGI entry point, for servers that only speak ASGI. It is slower than wsgi.py under gunicorn gthread workers,
+which stays the recommended deployment, see asgi_adapter.py.
+
+    uvicorn asgi:application --app-dir src --workers 2
+    gunicorn asgi:application --chdir ./src/ -k uvicorn.workers.UvicornWorker
+"""
+from asgi_adapter import WSGIAdapter
+from main import create_app, SERVER_CONFIG
+
+application = WSGIAdapter(create_app(SERVER_CONFIG))
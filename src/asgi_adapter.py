@@ -0,0 +1,130 @@
+"""
+Serves a WSGI app over ASGI, see asgi.py. A compatibility shim for platforms that only run ASGI servers,
+not a faster or more scalable deployment: gunicorn with gthread workers (the Procfile) stays the recommended one.
+The event loop owns the sockets, so slow clients and idle keep-alive connections cost no thread, but
+each request still runs the Flask app on a thread of a pool of ASGI_THREADS threads, the same concurrency
+as gthread, plus a hop to the loop for every message sent. benchmarks/endpoints.py --driver wsgi --driver asgi
+measured /get-favorites at a p50 of 48ms over ASGI against 18ms over WSGI.
+Unlike asgiref's WsgiToAsgi, which runs every request on one shared thread by default, the requests of a process
+really run side by side, up to ASGI_THREADS of them. Keep ASGI_THREADS close to DB_POOL_SIZE + DB_MAX_OVERFLOW
+since the endpoints mostly wait on the database.
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+#* Request bodies above this size are spooled to disk instead of kept in memory
+MAX_BODY_IN_MEMORY = 1024 * 1024
+
+
+class WSGIAdapter:
+    """Serves a WSGI app over ASGI http, the app and the iteration of its response run on the executor."""
+
+    def __init__(self, wsgi_application, threads=ASGI_THREADS):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError("Unsupported ASGI scope type %s" % scope["type"])
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def send_threadsafe(message):
+            #* Blocks the worker thread until the loop sent the message, a slow client slows its own response only
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        try:
+            await loop.run_in_executor(self.executor, self.run_wsgi, environ_from_scope(scope, body), send_threadsafe)
+        finally:
+            body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, receive):
+        body = SpooledTemporaryFile(max_size=MAX_BODY_IN_MEMORY)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None
+            body.write(message.get("body", b""))
+            if not message.get("more_body", False):
+                body.seek(0)
+                return body
+
+    def run_wsgi(self, environ, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+            return lambda data: send_chunk(data)
+
+        def send_chunk(data):
+            if not response.get("started"):
+                send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+                response["started"] = True
+            if data:
+                send({"type": "http.response.body", "body": data, "more_body": True})
+
+        iterable = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in iterable:
+                send_chunk(chunk)
+            send_chunk(b"")
+            send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def environ_from_scope(scope, body):
+    """PEP 3333 environ of an ASGI http scope, strings are latin1 decoded bytes as WSGI expects."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
@@ -0,0 +1,83 @@
+"""
+Builds current_user from the access token instead of loading the User row on every request.
+The token created by /login carries the claims the handlers read, and a short lived cache of
+is_active keeps deactivated users out without a query per request.
+Set JWT_STATELESS_IDENTITY=false to go back to loading the full User on every request.
+"""
+import os
+from sqlalchemy import select, event, inspect
+from sqlalchemy.orm import Session, object_session
+from models import db, User
+from favorites_cache import MemoryBackend
+
+JWT_STATELESS_IDENTITY = os.environ.get('JWT_STATELESS_IDENTITY', 'true').lower() != 'false'
+
+
+class TokenIdentity:
+    """Lightweight stand in for User with the fields the token carries."""
+    __slots__ = ("id", "username", "email")
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    def __repr__(self):
+        return '<TokenIdentity %s>' % self.username
+
+
+class ActiveUsers:
+    """
+    Caches is_active per user for ttl seconds. A change of User.is_active committed through the ORM
+    (the admin, a script using the models) invalidates the entry in this process right away. A change made
+    in raw SQL, or committed by another worker since the cache is local to the process, is seen at most ttl seconds later.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.backend = MemoryBackend(max_entries=max_entries, ttl=ttl)
+
+    def is_active(self, user_id):
+        is_active = self.backend.get(user_id)
+        if is_active is None:
+            row = db.session.execute(select(User.is_active).where(User.id == user_id)).one_or_none()
+            #* Rows created before is_active was filled in have it NULL, only an explicit False locks the user out
+            is_active = row is not None and row.is_active is not False
+            self.backend.set(user_id, is_active)
+        return is_active
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+
+active_users = ActiveUsers(ttl=int(os.environ.get('AUTH_ACTIVE_CACHE_TTL', 60)))
+
+
+@event.listens_for(User, "after_update")
+def _remember_is_active_change(mapper, connection, target):
+    if inspect(target).attrs.is_active.history.has_changes():
+        object_session(target).info.setdefault("is_active_changed", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_active_users(session):
+    #* After the commit, so a request running meanwhile can not cache the value being replaced
+    for user_id in session.info.pop("is_active_changed", ()):
+        active_users.invalidate(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_is_active_changes(session):
+    session.info.pop("is_active_changed", None)
+
+
+def identity_claims(user):
+    return {"username": user.username, "email": user.email}
+
+
+def load_current_user(jwt_data):
+    """user_lookup_loader body, returning None makes flask_jwt_extended answer 401."""
+    user_id = int(jwt_data["sub"])
+    #* Tokens issued before the claims existed still go through the database
+    if not JWT_STATELESS_IDENTITY or "username" not in jwt_data:
+        return User.query.filter_by(id=user_id).one_or_none()
+    if not active_users.is_active(user_id):
+        return None
+    return TokenIdentity(user_id, jwt_data["username"], jwt_data.get("email"))
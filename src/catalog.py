@@ -0,0 +1,228 @@
+"""
+Read only snapshot of the Planet and Character tables.
+Both tables only change when initial_loader runs, so every worker keeps them in memory
+indexed by local_id and by name and the hot paths never query them.
+A background thread per worker reads the tables again every CATALOG_REFRESH_SECONDS to pick up a
+/load_data run made by another worker, and swaps the snapshot only when a row actually changed.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Planet, Character
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogRecord:
+    """Immutable row of the catalog, the subclasses list the columns they keep in __slots__."""
+    __slots__ = ()
+    model = None
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Catalog records are read only")
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.name)
+
+    @classmethod
+    def columns(cls):
+        return [getattr(cls.model, field) for field in cls.__slots__]
+
+    def serialize(self):
+        #* Same shape as the model, built from the fields the model declares
+        return {field: getattr(self, field) for field in self.model.serialize_fields}
+
+
+class PlanetRecord(CatalogRecord):
+    __slots__ = ("id", "local_id", "name", "climate", "population", "terrain",
+                 "rotation_period", "orbital_period", "diameter", "surface_water")
+    model = Planet
+
+
+class CharacterRecord(CatalogRecord):
+    __slots__ = ("id", "local_id", "name", "birth_day", "gender", "height",
+                 "skin_color", "hair_color", "eye_color", "homeworld")
+    model = Character
+
+
+class CatalogTable:
+    """Records sorted by local_id, with hash indexes by local_id and by lowercase name."""
+
+    def __init__(self, records):
+        self.records = tuple(sorted(records, key=lambda record: record.local_id))
+        self.local_ids = tuple(record.local_id for record in self.records)
+        self._by_local_id = {record.local_id: record for record in self.records}
+        self._by_name = {}
+        for record in self.records:
+            if record.name is not None:
+                self._by_name.setdefault(record.name.lower(), record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def rows(self):
+        return [tuple(getattr(record, field) for field in record.__slots__) for record in self.records]
+
+    def __contains__(self, local_id):
+        return local_id in self._by_local_id
+
+    def get(self, local_id):
+        return self._by_local_id.get(local_id)
+
+    def find_by_name(self, name):
+        return self._by_name.get(name.lower())
+
+    def after(self, local_id):
+        """Records with a local_id greater than the given one, found with a binary search."""
+        start = 0 if local_id is None else bisect_right(self.local_ids, local_id)
+        return self.records[start:]
+
+    def memory_footprint(self):
+        size = sys.getsizeof(self.records) + sys.getsizeof(self.local_ids)
+        size += sys.getsizeof(self._by_local_id) + sys.getsizeof(self._by_name)
+        for record in self.records:
+            size += sys.getsizeof(record)
+            size += sum(sys.getsizeof(getattr(record, field)) for field in record.__slots__)
+        return size
+
+
+class CatalogSnapshot:
+    def __init__(self, planets, characters, loaded_at=None):
+        self.planets = CatalogTable(planets)
+        self.characters = CatalogTable(characters)
+        self.loaded_at = loaded_at
+
+    def memory_footprint(self):
+        return self.planets.memory_footprint() + self.characters.memory_footprint()
+
+    def same_rows(self, other):
+        return self.planets.rows() == other.planets.rows() and self.characters.rows() == other.characters.rows()
+
+    def stats(self):
+        return {
+            "planets": len(self.planets),
+            "characters": len(self.characters),
+            "memory_bytes": self.memory_footprint(),
+            "loaded_at": self.loaded_at,
+        }
+
+
+_snapshot = CatalogSnapshot((), ())
+_reload_lock = threading.Lock()
+_reload_listeners = []
+#* time.time() of the last reload, changed or not. loaded_at stays the time the rows of the snapshot were read
+last_refresh_at = None
+
+#* Other workers only see a /load_data run after this many seconds, 0 disables the background refresh
+CATALOG_REFRESH_SECONDS = int(os.environ.get('CATALOG_REFRESH_SECONDS', 300))
+
+
+def on_reload(callback):
+    """Registers callback(old_snapshot, new_snapshot), it runs after every reload. Usable as a decorator."""
+    _reload_listeners.append(callback)
+    return callback
+
+
+def load_snapshot():
+    planets = [PlanetRecord(*row) for row in db.session.execute(select(*PlanetRecord.columns()))]
+    characters = [CharacterRecord(*row) for row in db.session.execute(select(*CharacterRecord.columns()))]
+    return CatalogSnapshot(planets, characters, loaded_at=time.time())
+
+
+def reload_catalog():
+    """
+    Reads both tables again and swaps the snapshot when a row changed, needs an app context.
+    The listeners only run after a swap, an unchanged catalog keeps its snapshot and every cache built on it.
+    """
+    global _snapshot, last_refresh_at
+    with _reload_lock:
+        new_snapshot = load_snapshot()
+        last_refresh_at = new_snapshot.loaded_at
+        old_snapshot = _snapshot
+        if old_snapshot.loaded_at is not None and new_snapshot.same_rows(old_snapshot):
+            #* The snapshot is shared with the readers and keys their caches, it is never modified
+            return old_snapshot
+        _snapshot = new_snapshot
+    for callback in _reload_listeners:
+        callback(old_snapshot, new_snapshot)
+    logger.info("Catalog loaded: %(planets)s planets, %(characters)s characters, %(memory_bytes)s bytes", new_snapshot.stats())
+    return new_snapshot
+
+
+class CatalogRefresher:
+    """Daemon thread calling reload_catalog every interval seconds, so no request ever waits for a refresh."""
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    reload_catalog()
+            except Exception:
+                logger.exception("Catalog refresh failed, the current snapshot stays in use")
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start_refresher(app):
+    """Starts the refresh thread of this process once, a forked worker starts its own on its first get_catalog."""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None and CATALOG_REFRESH_SECONDS:
+            _refresher = CatalogRefresher(app, CATALOG_REFRESH_SECONDS).start()
+
+
+def _forget_refresher():
+    #* Threads do not survive a fork, the child starts its own
+    global _refresher
+    _refresher = None
+
+
+os.register_at_fork(after_in_child=_forget_refresher)
+
+
+def get_catalog():
+    snapshot = _snapshot
+    if _refresher is None and CATALOG_REFRESH_SECONDS and has_app_context():
+        start_refresher(current_app._get_current_object())
+    if snapshot.loaded_at is None:
+        #* Nothing loaded yet (the tables did not exist at startup), this request pays for the first load
+        return reload_catalog()
+    return snapshot
+
+
+def load_catalog_on_startup(app):
+    with app.app_context():
+        try:
+            reload_catalog()
+        except SQLAlchemyError as error:
+            #* The tables may not exist yet (before the first upgrade), get_catalog retries on the first request
+            db.session.rollback()
+            logger.warning("The catalog could not be loaded at startup: %s", error.__class__.__name__)
@@ -0,0 +1,114 @@
+from flask import request, Response
+from werkzeug.http import generate_etag
+from utils import APIException
+from catalog import get_catalog, on_reload
+from encoders import dumps, encode_records
+from favorites_cache import MemoryBackend
+
+#* Columns each catalog endpoint can be filtered by, matched case insensitive against every comma separated value
+PLANET_FILTERS = ("name", "climate", "terrain", "population")
+CHARACTER_FILTERS = ("name", "gender", "birth_day", "skin_color", "hair_color", "eye_color")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+CACHE_MAX_AGE = 300
+
+#* The catalog only changes on reload, so every page is encoded once and served as bytes until then
+encoded_pages = MemoryBackend(max_entries=512, ttl=24 * 3600)
+
+@on_reload
+def clear_encoded_pages(old_snapshot, new_snapshot):
+    encoded_pages.clear()
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Query string parsing
+def parse_int_arg(args, name, default=None, minimum=None, maximum=None):
+    value = args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise APIException("%s must be an integer" % name, status_code=400)
+    if minimum is not None and value < minimum:
+        raise APIException("%s must be at least %d" % (name, minimum), status_code=400)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+def parse_filters(args, allowed_filters):
+    filters = {}
+    for name in allowed_filters:
+        value = args.get(name)
+        if value:
+            filters[name] = value.strip().lower()
+    return filters
+
+def parse_fields(args, catalog_table):
+    fields = args.get("fields")
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if not len(catalog_table):
+        return tuple(fields) or None
+    known_fields = catalog_table.records[0].model.serialize_fields
+    unknown_fields = [field for field in fields if field not in known_fields]
+    if unknown_fields:
+        raise APIException("Unknown fields: %s" % ", ".join(unknown_fields), status_code=400)
+    return tuple(fields) or None
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Paging
+def matches(record, filters):
+    for name, wanted in filters.items():
+        value = getattr(record, name)
+        if value is None:
+            return False
+        if wanted not in (part.strip() for part in str(value).lower().split(",")):
+            return False
+    return True
+
+def page_records(catalog_table, after, limit, filters):
+    """
+    Keyset pagination on local_id: the cursor is the last local_id of the previous page and the start
+    of the next page is found with a binary search, so every page costs the same no matter how deep it is.
+    """
+    results = []
+    for record in catalog_table.after(after):
+        if matches(record, filters):
+            if len(results) == limit:
+                return results, results[-1].local_id
+            results.append(record)
+    return results, None
+
+def encode_page(records, next_cursor, fields):
+    #* Without a projection the records keep the shape of the model's serialize()
+    results = encode_records(records, fields or records[0].model.serialize_fields) if records else b"[]"
+    return b'{"results":' + results + b',"next_cursor":' + dumps(next_cursor) + b"}\n"
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Response
+def catalog_response(category):
+    catalog = get_catalog()
+    if category == "planets":
+        catalog_table, allowed_filters = catalog.planets, PLANET_FILTERS
+    else:
+        catalog_table, allowed_filters = catalog.characters, CHARACTER_FILTERS
+
+    after = parse_int_arg(request.args, "after")
+    limit = parse_int_arg(request.args, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    filters = parse_filters(request.args, allowed_filters)
+    fields = parse_fields(request.args, catalog_table)
+
+    cache_key = (category, after, limit, tuple(sorted(filters.items())), fields)
+    encoded_page = encoded_pages.get(cache_key)
+    if encoded_page is None:
+        records, next_cursor = page_records(catalog_table, after, limit, filters)
+        body = encode_page(records, next_cursor, fields)
+        encoded_page = (body, generate_etag(body))
+        encoded_pages.set(cache_key, encoded_page)
+    body, etag = encoded_page
+
+    #* Strong ETag over the exact body, werkzeug answers If-None-Match with an empty 304
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response.make_conditional(request)
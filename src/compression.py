@@ -0,0 +1,117 @@
+"""
+gzip / brotli compression of the responses, negotiated with Accept-Encoding.
+Only text like bodies of at least COMPRESSION_MIN_SIZE bytes are compressed, smaller ones cost more CPU than
+they save. Streamed responses (the exports) are compressed chunk by chunk and every chunk is flushed, so they
+keep streaming. brotli is optional, it is offered only when the brotli package is installed.
+Public responses (the catalog pages) have an ETag over their exact body, their compressed bodies are
+cached per ETag so a page is compressed once.
+"""
+import os
+import zlib
+from flask import request
+from favorites_cache import MemoryBackend
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+#* Brotli's top qualities are meant for static assets, 4 compresses better than gzip -6 at a similar speed
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html")
+
+compressed_bodies = MemoryBackend(max_entries=512, ttl=86400)
+
+
+class GzipCompressor:
+    def __init__(self):
+        #* wbits 16 + MAX_WBITS writes the gzip header and trailer instead of a raw zlib stream
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+COMPRESSORS = {"gzip": GzipCompressor, "br": BrotliCompressor}
+
+
+def compress_body(body, encoding):
+    compressor = COMPRESSORS[encoding]()
+    return compressor.compress(body) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    compressor = COMPRESSORS[encoding]()
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk) + compressor.flush()
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200 or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+        etag, weak = response.get_etag()
+        cache_key = (encoding, etag) if etag and not weak and response.cache_control.public else None
+        compressed = compressed_bodies.get(cache_key) if cache_key else None
+        if compressed is None:
+            compressed = compress_body(body, encoding)
+            if cache_key:
+                compressed_bodies.set(cache_key, compressed)
+        response.set_data(compressed)
+
+    response.headers["Content-Encoding"] = encoding
+    #* The compressed body is a different representation, If-None-Match compares ETags weakly so revalidation still works
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
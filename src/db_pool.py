@@ -0,0 +1,77 @@
+"""
+Connection pool of the SQLAlchemy engine.
+The pool is sized from the environment (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT), connections
+older than DB_POOL_RECYCLE seconds are replaced and, with DB_POOL_PRE_PING, tested before being handed out
+so idle connections closed by the server never reach a request.
+Every worker process gets its own connections after fork, and /metrics reports the checkout wait
+time and how many connections are in use so the pool can be sized from real traffic.
+"""
+import os
+import time
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from instrumentation import metrics
+from utils import env_flag
+
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long every checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db_pool_checkout_wait_seconds", time.perf_counter() - start, buckets=POOL_WAIT_BUCKETS)
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database, the pool sizing is left alone for SQLite."""
+    options = {
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "true"),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    }
+    if database_uri is None or make_url(database_uri).get_backend_name() == "sqlite":
+        return options
+    options.update({
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_use_lifo": True,
+    })
+    return options
+
+
+def pool_status(engines):
+    status = {}
+    for bind_key, engine in engines.items():
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        bind = bind_key or "primary"
+        status.update({
+            (("bind", bind), ("state", "in_use")): pool.checkedout(),
+            (("bind", bind), ("state", "idle")): pool.checkedin(),
+            (("bind", bind), ("state", "overflow")): max(pool.overflow(), 0),
+            (("bind", bind), ("state", "size")): pool.size(),
+        })
+    return status
+
+
+def init_pool(app, db):
+    """Registers the pool gauges and drops the parent's connections in every forked worker."""
+    def engines():
+        with app.app_context():
+            return db.engines
+
+    def dispose_inherited():
+        #* close=False leaves the sockets to the parent, the child just forgets them and opens its own
+        for engine in engines().values():
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=dispose_inherited)
+    metrics.describe("db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a pooled connection")
+    metrics.register_gauge("db_pool_connections", "Pooled connections by bind and state", lambda: pool_status(engines()))
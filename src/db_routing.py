@@ -0,0 +1,73 @@
+"""
+Read replica routing.
+When DB_REPLICA_URL is set the replica is registered as the "replica" bind and RoutingSession sends the
+queries of GET/HEAD/OPTIONS requests to it. Everything else goes to the primary: other methods, flushes,
+INSERT/UPDATE/DELETE statements, work outside of a request (startup, background jobs, CLI) and every
+query issued after the request wrote something.
+A user who wrote something keeps reading from the primary for DB_REPLICA_STICKY_SECONDS so the replica
+lag never hides their own changes. The window is shared between workers through FAVORITES_CACHE_URL when it is set.
+"""
+import os
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from favorites_cache import MemoryBackend, RedisBackend
+from db_pool import engine_options
+from utils import request_identity
+
+DB_REPLICA_URL = os.environ.get('DB_REPLICA_URL')
+DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+REPLICA_BIND = "replica"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def sticky_backend_from_env():
+    url = os.environ.get('FAVORITES_CACHE_URL')
+    if url:
+        return RedisBackend.from_url(url, ttl=DB_REPLICA_STICKY_SECONDS, prefix="replica-sticky:")
+    return MemoryBackend(max_entries=10000, ttl=DB_REPLICA_STICKY_SECONDS)
+
+
+sticky_writers = sticky_backend_from_env()
+
+
+def replica_binds(replica_url=DB_REPLICA_URL):
+    """SQLALCHEMY_BINDS with the replica, empty when no replica is configured."""
+    if not replica_url:
+        return {}
+    return {REPLICA_BIND: {"url": replica_url, **engine_options(replica_url)}}
+
+
+def is_write(session, clause):
+    return session._flushing or (clause is not None and getattr(clause, "is_dml", False))
+
+
+def reads_from_replica(session):
+    if not has_request_context() or request.method not in READ_METHODS or g.get("db_wrote"):
+        return False
+    if REPLICA_BIND not in session._db.engines:
+        return False
+    identity = request_identity()
+    return identity is None or sticky_writers.get(identity) is None
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if is_write(self, clause):
+                if has_request_context():
+                    g.db_wrote = True
+            elif reads_from_replica(self):
+                return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def mark_sticky_writer(response):
+    if g.get("db_wrote"):
+        identity = request_identity()
+        if identity is not None:
+            sticky_writers.set(identity, True)
+    return response
+
+
+def init_routing(app):
+    app.after_request(mark_sticky_writer)
@@ -0,0 +1,138 @@
+"""
+Streaming exports of the favorites and the catalog as newline delimited JSON or CSV.
+Favorites are read through a server side cursor (yield_per) and every partition is encoded and sent as soon
+as it arrives, so memory stays flat whatever the number of rows and the first byte goes out right away.
+"""
+import csv
+import io
+import sys
+import click
+from flask import Response, stream_with_context
+from flask.cli import AppGroup
+from sqlalchemy import select, literal, union_all
+from models import db, FavoritePlanet, FavoriteCharacter
+from catalog import get_catalog
+from encoders import dumps
+from utils import APIException
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+FAVORITE_FIELDS = ("user_id", "category", "id", "name")
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Rows
+def favorites_statement(user_id=None):
+    selects = []
+    for category, favorite_model, column_name in (
+        ("CHARACTER", FavoriteCharacter, "character_id"),
+        ("PLANET", FavoritePlanet, "planet_id"),
+    ):
+        statement = select(
+            favorite_model.user_id,
+            literal(category).label("category"),
+            getattr(favorite_model, column_name).label("local_id"),
+        )
+        if user_id is not None:
+            statement = statement.where(favorite_model.user_id == user_id)
+        selects.append(statement)
+    return union_all(*selects)
+
+def favorite_batches(user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yields lists of favorite dicts, names come from the in memory catalog instead of a join."""
+    catalog = get_catalog()
+    tables = {"CHARACTER": catalog.characters, "PLANET": catalog.planets}
+    result = db.session.execute(favorites_statement(user_id).execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        batch = []
+        for row in partition:
+            record = tables[row.category].get(row.local_id)
+            batch.append({
+                "user_id": row.user_id,
+                "category": row.category,
+                "id": row.local_id,
+                "name": record.name if record is not None else None,
+            })
+        yield batch
+
+def catalog_batches(category, batch_size=EXPORT_BATCH_SIZE):
+    catalog_table = get_catalog().planets if category == "planets" else get_catalog().characters
+    records = catalog_table.records
+    for start in range(0, len(records), batch_size):
+        yield [record.serialize() for record in records[start:start + batch_size]]
+
+def catalog_fields(category):
+    catalog_table = get_catalog().planets if category == "planets" else get_catalog().characters
+    return catalog_table.records[0].model.serialize_fields if len(catalog_table) else ()
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Encoding
+def encode_ndjson(batches):
+    for batch in batches:
+        if batch:
+            yield b"".join(dumps(row) + b"\n" for row in batch)
+
+def encode_csv(batches, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+
+def encode(batches, export_format, fields):
+    if export_format == "csv":
+        return encode_csv(batches, fields)
+    return encode_ndjson(batches)
+
+def parse_format(export_format):
+    export_format = (export_format or "ndjson").lower()
+    if export_format not in EXPORT_FORMATS:
+        raise APIException("format must be one of %s" % ", ".join(EXPORT_FORMATS), status_code=400)
+    return export_format
+
+def streaming_response(chunks, export_format, filename):
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format])
+    response.headers["Content-Disposition"] = "attachment; filename=%s.%s" % (filename, export_format)
+    return response
+
+def favorites_export_response(user_id, export_format):
+    export_format = parse_format(export_format)
+    chunks = encode(favorite_batches(user_id), export_format, FAVORITE_FIELDS)
+    return streaming_response(chunks, export_format, "favorites")
+
+def catalog_export_response(category, export_format):
+    export_format = parse_format(export_format)
+    if category not in ("planets", "characters"):
+        raise APIException("category must be planets or characters", status_code=400)
+    chunks = encode(catalog_batches(category), export_format, catalog_fields(category))
+    return streaming_response(chunks, export_format, category)
+
+#!-----------------------------------------------------------------------------------------------------------------------------------CLI
+export_cli = AppGroup("export", help="Stream the favorites or the catalog as NDJSON or CSV.")
+
+def write_chunks(chunks, output):
+    stream = open(output, "wb") if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
+@export_cli.command("favorites")
+@click.option("--user-id", type=int, help="Only this user, every user by default")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson")
+@click.option("--output", type=click.Path(dir_okay=False), help="File to write, stdout by default")
+def export_favorites_command(user_id, export_format, output):
+    write_chunks(encode(favorite_batches(user_id), export_format, FAVORITE_FIELDS), output)
+
+@export_cli.command("catalog")
+@click.argument("category", type=click.Choice(["planets", "characters"]))
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson")
+@click.option("--output", type=click.Path(dir_okay=False), help="File to write, stdout by default")
+def export_catalog_command(category, export_format, output):
+    write_chunks(encode(catalog_batches(category), export_format, catalog_fields(category)), output)
@@ -0,0 +1,195 @@
+"""
+Per user cache of the merged favorites payload served by /get-favorites.
+The entries are written through by update_favorites_lists, so a read only goes to the database after a miss or an expiration.
+Every entry carries the favorites version it was built from and a write never replaces an entry with a higher version,
+so a cache miss that loaded the favorites before a concurrent write can not put its older state back on top.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """LRU bounded to max_entries where every entry also expires ttl seconds after it was written. Local to the worker process."""
+
+    def __init__(self, max_entries=1024, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_if_newer(self, key, value, version_key="version"):
+        """Writes value unless the entry holds a higher value[version_key]. Returns whether it was written."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock() and entry[1][version_key] > value[version_key]:
+                return False
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shares the entries between gunicorn workers through any client with the redis-py get/set/delete signatures."""
+
+    #* Compare and set in one round trip, the entries are JSON objects
+    SET_IF_NEWER_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        if current and cjson.decode(current)[ARGV[3]] > tonumber(ARGV[2]) then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+        return 1
+    """
+
+    def __init__(self, client, ttl=300, prefix="favorites:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._set_if_newer = None
+
+    @classmethod
+    def from_url(cls, url, ttl=300, prefix="favorites:"):
+        #* redis is optional, it is only needed when FAVORITES_CACHE_URL is set
+        import redis
+        return cls(redis.Redis.from_url(url), ttl=ttl, prefix=prefix)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + str(key))
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=self.ttl)
+
+    def set_if_newer(self, key, value, version_key="version"):
+        if self._set_if_newer is None:
+            self._set_if_newer = self.client.register_script(self.SET_IF_NEWER_SCRIPT)
+        return bool(self._set_if_newer(keys=[self.prefix + str(key)],
+                                       args=[json.dumps(value), value[version_key], version_key, self.ttl]))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+class FavoritesCache:
+    """Counts hits and misses on top of a backend. Backend failures fall back to the loader instead of failing the request."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_or_load(self, user_id, loader):
+        try:
+            cached = self.backend.get(user_id)
+        except Exception:
+            logger.exception("Favorites cache read failed")
+            self.errors += 1
+            cached = None
+        #* An entry without favorites only records the version of a write, see invalidate
+        if cached is not None and cached.get("favorites") is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        payload = loader()
+        self.store(user_id, payload)
+        return payload
+
+    def store(self, user_id, payload):
+        """Writes the state of one user, unless the cache already holds a newer version of it."""
+        try:
+            self.backend.set_if_newer(user_id, payload)
+        except Exception:
+            logger.exception("Favorites cache write failed")
+            self.errors += 1
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id, version=None):
+        """
+        Drops the entry of one user. With the version of the write that made it stale the entry is replaced
+        by a marker of that version instead, so a load that read an older version can not be cached after it.
+        """
+        if version is not None:
+            try:
+                self.backend.set_if_newer(user_id, {"version": version, "updated_at": None, "favorites": None})
+                return
+            except Exception:
+                logger.exception("Favorites cache write failed")
+                self.errors += 1
+        try:
+            self.backend.delete(user_id)
+        except Exception:
+            logger.exception("Favorites cache invalidation failed")
+            self.errors += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "entries": len(self.backend),
+        }
+
+
+def cache_from_env():
+    ttl = int(os.environ.get('FAVORITES_CACHE_TTL', 300))
+    url = os.environ.get('FAVORITES_CACHE_URL')
+    if url:
+        #* The prefix names the entry format, entries written by older deployments are never read back
+        return FavoritesCache(RedisBackend.from_url(url, ttl=ttl, prefix="favorites-state:"))
+    max_entries = int(os.environ.get('FAVORITES_CACHE_SIZE', 1024))
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        #* A write is only seen by the worker that made it, the others keep their copy until it expires
+        ttl = min(ttl, int(os.environ.get('FAVORITES_CACHE_LOCAL_TTL', 5)))
+        logger.warning("Several workers without FAVORITES_CACHE_URL, the favorites cache keeps entries for %ds only", ttl)
+    return FavoritesCache(MemoryBackend(max_entries=max_entries, ttl=ttl))
+
+
+favorites_cache = cache_from_env()
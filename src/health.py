@@ -0,0 +1,54 @@
+"""
+/healthz: answers from memory and pings the databases at most once every HEALTHZ_TTL seconds per process,
+so load balancer checks and uptime bots cost one SELECT 1 per interval whatever their rate.
+"""
+import os
+import threading
+import time
+from sqlalchemy import text
+
+HEALTHZ_TTL = float(os.environ.get('HEALTHZ_TTL', 5))
+
+
+class DatabasePing:
+    def __init__(self, ttl=HEALTHZ_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._result = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def status(self, engines):
+        """{bind: "ok" | error class name}, cached for ttl seconds. A check that is already running is not repeated."""
+        if self._checked_at is not None and self.clock() - self._checked_at < self.ttl:
+            return self._result
+        if not self._lock.acquire(blocking=False):
+            #* Another thread is pinging right now, its previous answer is good enough
+            return self._result or self.ping(engines)
+        try:
+            self._result = self.ping(engines)
+            self._checked_at = self.clock()
+            return self._result
+        finally:
+            self._lock.release()
+
+    def ping(self, engines):
+        result = {}
+        for bind_key, engine in engines.items():
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                result[bind_key or "primary"] = "ok"
+            except Exception as error:
+                result[bind_key or "primary"] = error.__class__.__name__
+        return result
+
+
+database_ping = DatabasePing()
+
+
+def health_response(engines):
+    databases = database_ping.status(engines)
+    healthy = all(status == "ok" for status in databases.values())
+    body = {"status": "ok" if healthy else "unavailable", "databases": databases}
+    return body, 200 if healthy else 503, {"Cache-Control": "no-store"}
@@ -1,33 +1,163 @@
-
-#todo this package loads the character and planet information from the api
+"""
+Seeds the Character and Planet tables from swapi.dev.
+Every page is fetched concurrently through a pooled session that retries with backoff, and the rows
+are upserted in bulk keyed on local_id, so running the load again only refreshes the data.
+Set SWAPI_FIXTURE_DIR to replay <resource>-<page>.json files from disk instead of calling the API.
+"""
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from models import db, Character,Planet
+from sql_helpers import upsert_rows
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SWAPI_URL = os.environ.get('SWAPI_URL', 'https://swapi.dev/api')
+SWAPI_FIXTURE_DIR = os.environ.get('SWAPI_FIXTURE_DIR')
+SWAPI_WORKERS = int(os.environ.get('SWAPI_WORKERS', 8))
+SWAPI_TIMEOUT = float(os.environ.get('SWAPI_TIMEOUT', 10))
+
+
+class LoadStats:
+    """Progress of a load, safe to read from another thread while the load runs."""
+
+    def __init__(self):
+        self.pages_fetched = 0
+        self.rows_upserted = 0
+        self._lock = threading.Lock()
+
+    def page_fetched(self):
+        with self._lock:
+            self.pages_fetched += 1
+
+    def rows_written(self, count):
+        with self._lock:
+            self.rows_upserted += count
+
+    def to_dict(self):
+        return {"pages_fetched": self.pages_fetched, "rows_upserted": self.rows_upserted}
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Sources
+class HttpSource:
+    def __init__(self, base_url=SWAPI_URL, workers=SWAPI_WORKERS, timeout=SWAPI_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        #* One keep-alive connection per worker, transient failures are retried with exponential backoff
+        retry = Retry(total=4, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self, resource, page):
+        response = self.session.get("%s/%s/" % (self.base_url, resource), params={"page": page}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class FixtureSource:
+    """Replays pages saved as <resource>-<page>.json, used to run and benchmark the loader offline."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, resource, page):
+        with open(os.path.join(self.directory, "%s-%d.json" % (resource, page))) as fixture:
+            return json.load(fixture)
+
+
+def default_source():
+    if SWAPI_FIXTURE_DIR:
+        return FixtureSource(SWAPI_FIXTURE_DIR)
+    return HttpSource()
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Fetching
+def fetch_all_pages(source, resources, workers=SWAPI_WORKERS, stats=None):
+    """
+    Fetches the first page of every resource to learn the page count and then the remaining
+    pages of all resources at once, so the wall time is about two round trips.
+    """
+    stats = stats or LoadStats()
+
+    def fetch(resource, page):
+        payload = source.fetch(resource, page)
+        stats.page_fetched()
+        return payload
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first_pages = dict(zip(resources, executor.map(lambda resource: fetch(resource, 1), resources)))
+        pending = []
+        for resource, first_page in first_pages.items():
+            results[resource] = list(first_page['results'])
+            page_size = len(first_page['results']) or 1
+            page_count = math.ceil(first_page.get('count', 0) / page_size)
+            for page in range(2, page_count + 1):
+                pending.append((resource, executor.submit(fetch, resource, page)))
+        for resource, future in pending:
+            results[resource].extend(future.result()['results'])
+    return results
 
+#!-----------------------------------------------------------------------------------------------------------------------------------Mapping
+def swapi_id(url):
+    #* https://swapi.dev/api/people/17/ -> 17, stable across runs unlike the position in the page
+    return int(url.rstrip('/').rsplit('/', 1)[1])
 
-def initial_character_load ():
-    response_characters = requests.get("https://swapi.dev/api/people/")
-    json_response = response_characters.json()
-    print(json_response)
-    for index,person in enumerate (json_response['results']):
-        person_info=Character(name=person['name'],local_id=index+1, birth_day=person['birth_year'], gender = person['gender'], height = person['height'],skin_color = person['skin_color'],eye_color =person['eye_color'],hair_color=person["hair_color"])
-        db.session.add(person_info)
-    
-    db.session.commit()
+def to_int(value):
+    try:
+        return int(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
 
-def initial_planet_load():
-    response_planets = requests.get("https://swapi.dev/api/planets")
-    json_response = response_planets.json()
-    print(json_response)
-    for index, planet in enumerate (json_response['results']):
-        planet_info=Planet(name=planet['name'],local_id=index+1, climate=planet['climate'], population=planet['population'],terrain = planet['terrain'], rotation_period = planet['rotation_period'],orbital_period =planet['orbital_period'], diameter=planet['diameter'], surface_water=planet["surface_water"])
-        db.session.add(planet_info)
-    
-    db.session.commit()
+def character_row(person):
+    return {
+        "local_id": swapi_id(person['url']),
+        "name": person['name'],
+        "birth_day": person['birth_year'],
+        "gender": person['gender'],
+        "height": to_int(person['height']),
+        "skin_color": person['skin_color'],
+        "eye_color": person['eye_color'],
+        "hair_color": person['hair_color'],
+        "homeworld": str(swapi_id(person['homeworld'])) if person.get('homeworld') else None,
+    }
 
-def initial_loader():
-    initial_planet_load()
-    initial_character_load()
+def planet_row(planet):
+    return {
+        "local_id": swapi_id(planet['url']),
+        "name": planet['name'],
+        "climate": planet['climate'],
+        "population": planet['population'],
+        "terrain": planet['terrain'],
+        "rotation_period": planet['rotation_period'],
+        "orbital_period": planet['orbital_period'],
+        "diameter": planet['diameter'],
+        "surface_water": planet['surface_water'],
+    }
 
+#!-----------------------------------------------------------------------------------------------------------------------------------Loading
+def initial_character_load(people, stats):
+    rows = [character_row(person) for person in people]
+    stats.rows_written(upsert_rows(Character, rows, "local_id"))
 
-#initial_loader()
+def initial_planet_load(planets, stats):
+    rows = [planet_row(planet) for planet in planets]
+    stats.rows_written(upsert_rows(Planet, rows, "local_id"))
 
+def initial_loader(source=None, stats=None):
+    """Fetches every page and upserts planets and characters in one transaction, safe to run again."""
+    source = source or default_source()
+    stats = stats or LoadStats()
+    pages = fetch_all_pages(source, ("planets", "people"), stats=stats)
+    try:
+        #* Planets first, the characters reference them through homeworld
+        initial_planet_load(pages["planets"], stats)
+        initial_character_load(pages["people"], stats)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
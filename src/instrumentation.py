@@ -0,0 +1,186 @@
+"""
+Per endpoint timing: wall time, SQL statement count and SQL time of every request, kept as
+histograms and rendered in the Prometheus text format by /metrics.
+An admin can also get a cProfile dump of a single request by sending X-Profile: 1 together with
+the X-Admin-Token header, the file name comes back in the X-Profile-File response header.
+"""
+import cProfile
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils import is_admin_request
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def format_labels(labels):
+    return ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+
+
+class Metrics:
+    """Histograms and counters keyed by name and labels, plus gauges read from callbacks at scrape time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._gauges = []
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histogram_totals(self, name, **labels):
+        """(count, sum) of one histogram series, (0, 0.0) when nothing was observed yet."""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return (histogram.count, histogram.total) if histogram else (0, 0.0)
+
+    def register_gauge(self, name, help_text, callback):
+        """
+        callback returns a number, or a dict keyed by tuples of (label, value) pairs for labelled series.
+        Registering a name again replaces its callback, so every app built by create_app reports its own state.
+        """
+        self.describe(name, "gauge", help_text)
+        self._gauges = [gauge for gauge in self._gauges if gauge[0] != name] + [(name, callback)]
+
+    def render(self):
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._help:
+                kind, help_text = self._help[name]
+                lines.append("# HELP %s %s" % (name, help_text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                described.add(name)
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        for (name, labels), histogram in histograms:
+            header(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append("%s_bucket{%s} %d" % (name, format_labels(labels + (("le", bound),)), cumulative))
+            lines.append("%s_sum{%s} %s" % (name, format_labels(labels), repr(histogram.total)))
+            lines.append("%s_count{%s} %d" % (name, format_labels(labels), histogram.count))
+        for (name, labels), value in counters:
+            header(name)
+            lines.append("%s{%s} %s" % (name, format_labels(labels), value))
+        for name, callback in self._gauges:
+            header(name)
+            value = callback()
+            if isinstance(value, dict):
+                for labels, labelled_value in sorted(value.items()):
+                    lines.append("%s{%s} %s" % (name, format_labels(labels), labelled_value))
+            else:
+                lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("http_request_duration_seconds", "histogram", "Wall time of the request by endpoint")
+metrics.describe("http_request_sql_statements", "histogram", "SQL statements executed by one request")
+metrics.describe("http_request_sql_duration_seconds", "histogram", "Time spent in SQL by one request")
+metrics.describe("http_responses_total", "counter", "Responses by endpoint and status code")
+metrics.describe("sql_statement_errors_total", "counter", "SQL statements that raised, by endpoint")
+
+#!-----------------------------------------------------------------------------------------------------------------------------------SQL events
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def record_statement(conn, failed=False):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    in_request = has_request_context() and "sql_count" in g
+    if failed:
+        metrics.increment("sql_statement_errors_total", endpoint=endpoint_label() if in_request else "none")
+    #* Statements outside of a request (startup, background jobs) are not attributed to any endpoint
+    if in_request:
+        g.sql_count += 1
+        g.sql_time += elapsed
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(conn)
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    #* after_cursor_execute never runs for a statement that raised, its start time is taken off here
+    conn = exception_context.connection
+    if conn is not None and exception_context.statement is not None and conn.info.get("query_start_time"):
+        record_statement(conn, failed=True)
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Request hooks
+def endpoint_label():
+    return request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+
+def start_request():
+    g.request_start_time = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    if request.headers.get("X-Profile") and is_admin_request(request):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def finish_request(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_file = os.path.join(PROFILE_DIR, "%s-%d.prof" % (endpoint_label(), time.time() * 1000))
+        profiler.dump_stats(profile_file)
+        response.headers["X-Profile-File"] = profile_file
+    metrics.increment("http_responses_total", endpoint=endpoint_label(), status=response.status_code)
+    return response
+
+def record_request(error=None):
+    if "request_start_time" not in g:
+        return
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+    endpoint = endpoint_label()
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_start_time, endpoint=endpoint)
+    metrics.observe("http_request_sql_statements", g.sql_count, buckets=QUERY_COUNT_BUCKETS, endpoint=endpoint)
+    metrics.observe("http_request_sql_duration_seconds", g.sql_time, endpoint=endpoint)
+
+def init_instrumentation(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(record_request)
@@ -0,0 +1,169 @@
+"""
+Background jobs, so the request worker answers right away, used by /load_data and /accounts/bulk.
+The state of every job lives in the background_job table, so a status poll can land on any worker,
+and a unique lock_key lets only one job of a kind be queued or running across all the workers.
+The job itself runs on a thread of the worker that accepted it, a second thread publishes its progress
+to the table every JOB_HEARTBEAT_SECONDS, and a job whose row stops being updated belongs to a worker that died.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+#* A running job writes its progress and updated_at this often
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 10))
+#* An active job not updated for this long belongs to a worker that died, the next submit takes its place
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 300))
+#* Finished jobs are kept this long for status polling
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 86400))
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def job_to_dict(job, live_progress=None):
+    finished_at = job.finished_at or utc_now()
+    elapsed = (finished_at - job.started_at).total_seconds() if job.started_at is not None else 0.0
+    result = {
+        "id": job.id,
+        "status": job.status,
+        "elapsed_seconds": round(elapsed, 3),
+        "errors": job.errors or [],
+    }
+    result.update(live_progress.to_dict() if live_progress is not None else job.progress or {})
+    return result
+
+
+class JobRunner:
+    """
+    Runs the jobs of one kind on a single background thread of this process.
+    target(progress, **params) does the work, progress being a new progress_factory() whose to_dict()
+    is what the status shows. It runs inside an app context.
+    """
+
+    def __init__(self, kind, target, progress_factory):
+        self.kind = kind
+        self.target = target
+        self.progress_factory = progress_factory
+        #* Progress of the jobs running in this process, fresher than the table while they run
+        self.live = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=kind)
+
+    def _active_job(self):
+        return db.session.execute(
+            select(BackgroundJob).where(BackgroundJob.lock_key == self.kind).execution_options(populate_existing=True)
+        ).scalar_one_or_none()
+
+    def _release_stale(self, job):
+        #* Only releases the lock if nobody did in the meantime and the job did not publish its progress since it was read
+        db.session.execute(
+            update(BackgroundJob).where(BackgroundJob.id == job.id, BackgroundJob.lock_key == self.kind,
+                                        BackgroundJob.updated_at == job.updated_at)
+            .values(lock_key=None, status="failed", errors=["Abandoned, the worker running it stopped"], finished_at=utc_now())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def submit(self, app, **params):
+        """Queues a job and returns (job dict, True), or (active job dict, False) when one is already queued or running."""
+        now = utc_now()
+        db.session.execute(
+            delete(BackgroundJob).where(BackgroundJob.kind == self.kind, BackgroundJob.lock_key.is_(None),
+                                        BackgroundJob.created_at < now - timedelta(seconds=JOB_RETENTION_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+        for attempt in range(2):
+            job = BackgroundJob(id=uuid.uuid4().hex, kind=self.kind, status="queued", lock_key=self.kind,
+                                created_at=now, updated_at=now)
+            db.session.add(job)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                active_job = self._active_job()
+                if active_job is None:
+                    continue
+                if attempt == 0 and (active_job.updated_at or active_job.created_at) < now - timedelta(seconds=JOB_STALE_SECONDS):
+                    logger.warning("%s job %s is stale, releasing it", self.kind, active_job.id)
+                    self._release_stale(active_job)
+                    continue
+                return job_to_dict(active_job, self.live.get(active_job.id)), False
+            progress = self.live[job.id] = self.progress_factory()
+            self._executor.submit(self._run, app, job.id, progress, params)
+            return job_to_dict(job, progress), True
+        raise RuntimeError("Could not queue the %s job" % self.kind)
+
+    def get(self, job_id):
+        """Status of any job of this kind, whichever worker runs it. None for an unknown id."""
+        #* Read from the primary, a replica may not have the job that was just queued
+        job = db.session.execute(
+            #* populate_existing, the job is updated by another session and the one polling may already hold it
+            select(BackgroundJob).where(BackgroundJob.id == job_id, BackgroundJob.kind == self.kind)
+            .execution_options(populate_existing=True),
+            bind_arguments={"bind": db.engine},
+        ).scalar_one_or_none()
+        if job is None:
+            return None
+        return job_to_dict(job, self.live.get(job_id))
+
+    def _finish(self, job_id, **values):
+        db.session.execute(
+            update(BackgroundJob).where(BackgroundJob.id == job_id)
+            .values(lock_key=None, finished_at=utc_now(), updated_at=utc_now(), **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _heartbeat(self, app, job_id, progress, stopped):
+        #* Its own thread and app context, so its own session, the target owns the session of the job thread
+        with app.app_context():
+            while not stopped.wait(JOB_HEARTBEAT_SECONDS):
+                try:
+                    db.session.execute(
+                        update(BackgroundJob).where(BackgroundJob.id == job_id, BackgroundJob.status == "running")
+                        .values(progress=progress.to_dict(), updated_at=utc_now())
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+                except Exception:
+                    logger.exception("Could not publish the progress of %s job %s", self.kind, job_id)
+                    db.session.rollback()
+            db.session.remove()
+
+    def _run(self, app, job_id, progress, params):
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(app, job_id, progress, stopped),
+                                     name="%s-heartbeat" % self.kind, daemon=True)
+        with app.app_context():
+            try:
+                now = utc_now()
+                db.session.execute(
+                    update(BackgroundJob).where(BackgroundJob.id == job_id)
+                    .values(status="running", started_at=now, updated_at=now, progress=progress.to_dict())
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                heartbeat.start()
+                self.target(progress, **params)
+                stopped.set()
+                heartbeat.join()
+                self._finish(job_id, status="succeeded", progress=progress.to_dict())
+            except Exception as error:
+                logger.exception("%s job %s failed", self.kind, job_id)
+                db.session.rollback()
+                stopped.set()
+                if heartbeat.is_alive():
+                    heartbeat.join()
+                self._finish(job_id, status="failed", progress=progress.to_dict(),
+                             errors=["%s: %s" % (error.__class__.__name__, error)])
+            finally:
+                self.live.pop(job_id, None)
+                db.session.remove()
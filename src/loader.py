@@ -0,0 +1,39 @@
+"""
+/load_data endpoints, an optional blueprint: the SWAPI importer and its HTTP client are only imported
+by the workers that enable it (ENABLE_LOADER).
+"""
+from flask import Blueprint, current_app, jsonify, url_for
+from jobs import JobRunner
+from initialLoad import initial_loader, LoadStats
+from catalog import reload_catalog
+from rate_limit import limited
+from utils import APIException
+
+loader = Blueprint("loader", __name__)
+
+
+def run_load(stats):
+    initial_loader(stats=stats)
+    reload_catalog()
+
+
+load_jobs = JobRunner("load_data", run_load, LoadStats)
+
+
+@loader.route("/load_data", methods=["GET", "POST"])
+@limited("load_data", rate="6/minute", per="ip", concurrency=2)
+def load_data():
+    #* The load runs on a background thread, the client polls the status url
+    job, created = load_jobs.submit(current_app._get_current_object())
+    status_url = url_for(".load_data_status", job_id=job["id"])
+    if not created:
+        return jsonify(msg="A load is already running", job_id=job["id"], status_url=status_url), 409
+    return jsonify(job_id=job["id"], status_url=status_url), 202, {"Location": status_url}
+
+
+@loader.route("/load_data/<job_id>", methods=["GET"])
+def load_data_status(job_id):
+    job = load_jobs.get(job_id)
+    if job is None:
+        raise APIException("Unknown job", status_code=404)
+    return jsonify(job), 200
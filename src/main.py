@@ -1,16 +1,17 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+create_app(config) builds the app. `app` itself is only built the first time it is used, so
+`from main import app` and FLASK_APP=src/main.py keep working while wsgi.py and asgi.py build their own.
 """
+import time
+IMPORT_STARTED = time.perf_counter()
+
 #* Boilerplate libraries
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, Blueprint, request, jsonify, current_app, url_for
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User,Character,Planet,FavoritePlanet,FavoriteCharacter
-from werkzeug.security import safe_str_cmp
+from utils import APIException, is_admin_request, env_flag, route_auth, is_filled_string
+from models import db, User
 
 #* JWT libraries
 from flask_jwt_extended import create_access_token
@@ -19,63 +20,170 @@ from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
 
 #* Custom made libraries
-from initialLoad import initial_loader
-from payload_handlers import get_merged_lists,update_favorites_lists
+from auth import load_current_user, identity_claims
+from passwords import verify_unknown_user_pooled
+from instrumentation import init_instrumentation, metrics
+from encoders import FastJSONProvider
+from db_pool import engine_options, init_pool
+from db_routing import replica_binds, init_routing
+from compression import init_compression
+from exports import export_cli, favorites_export_response, catalog_export_response
+from rate_limit import limited
+from accounts import users_cli, import_jobs, spool_upload, format_from_mimetype
+from payload_handlers import update_favorites_lists,apply_favorite_operations
+from payload_handlers import parse_expected_version,favorites_etag,load_favorites_state,favorites_response
+from favorites_cache import favorites_cache
+from catalog_handlers import catalog_response
+from search import search_response
+import catalog
+from catalog import load_catalog_on_startup, get_catalog
+from startup import StartupReport
+from route_index import route_index_response
+from health import health_response
 
 #*Generic Libraries
+from sqlalchemy.exc import IntegrityError
 from datetime import timedelta
-import requests
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+jwt = JWTManager()
+api = Blueprint("api", __name__)
+debug = Blueprint("debug", __name__)
+
+#* The workers started by wsgi.py and asgi.py never run migrations, the release phase does it through FLASK_APP
+SERVER_CONFIG = {"ENABLE_MIGRATE": False}
+
+def default_config():
+    return {
+        "SECRET_KEY": os.environ.get('FLASK_APP_KEY', 'sample key'),
+        "SQLALCHEMY_DATABASE_URI": os.environ.get('DB_CONNECTION_STRING'),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        #* Optional parts, a worker that never serves them does not import them
+        "ENABLE_ADMIN": env_flag('ENABLE_ADMIN', 'true'),
+        "ENABLE_LOADER": env_flag('ENABLE_LOADER', 'true'),
+        "ENABLE_DEBUG_ROUTES": env_flag('ENABLE_DEBUG_ROUTES', 'true'),
+        "ENABLE_MIGRATE": True,
+        "PRELOAD_CATALOG": env_flag('PRELOAD_CATALOG', 'true'),
+    }
+
+_imports_reported = False
 
 #*MAIN SETUP
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-MIGRATE = Migrate(app, db)
-jwt = JWTManager(app)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+def create_app(config=None):
+    global _imports_reported
+    if _imports_reported:
+        report = StartupReport()
+    else:
+        #* The first app of the process also pays for the imports of this module
+        report = StartupReport(started=IMPORT_STARTED)
+        report.add("imports", IMPORT_SECONDS)
+        _imports_reported = True
+
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    app.config.setdefault('SQLALCHEMY_BINDS', replica_binds())
+    app.json = FastJSONProvider(app)
+    app.url_map.strict_slashes = False
+
+    with report.step("database"):
+        db.init_app(app)
+        init_pool(app, db)
+        init_routing(app)
+    with report.step("core"):
+        jwt.init_app(app)
+        CORS(app)
+        init_instrumentation(app)
+        init_compression(app)
+        app.register_error_handler(APIException, handle_invalid_usage)
+        app.register_blueprint(api)
+        app.cli.add_command(export_cli)
+        app.cli.add_command(users_cli)
+
+    if app.config['ENABLE_MIGRATE']:
+        with report.step("migrate"):
+            from flask_migrate import Migrate
+            Migrate(app, db)
+    if app.config['ENABLE_ADMIN']:
+        with report.step("admin"):
+            from admin import setup_admin
+            setup_admin(app)
+    if app.config['ENABLE_LOADER']:
+        with report.step("loader"):
+            from loader import loader
+            app.register_blueprint(loader)
+    if app.config['ENABLE_DEBUG_ROUTES']:
+        app.register_blueprint(debug)
+    if app.config['PRELOAD_CATALOG']:
+        with report.step("catalog"):
+            load_catalog_on_startup(app)
+
+    metrics.register_gauge("favorites_cache_events", "Favorites cache hits, misses and errors",
+        lambda: {(("event", name),): value for name, value in favorites_cache.stats().items() if name != "entries"})
+    metrics.register_gauge("catalog_memory_bytes", "Approximate size of the in memory catalog", lambda: get_catalog().memory_footprint())
+    metrics.register_gauge("catalog_last_refresh_timestamp_seconds", "Time of the last catalog reload, changed or not",
+        lambda: catalog.last_refresh_at or 0)
+    app.extensions["startup_report"] = report.finish()
+    metrics.register_gauge("app_startup_seconds", "Time spent building the app by component", report.gauge_values)
+    return app
+
+def __getattr__(name):
+    #* Module level `app`, built on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 #*end MAIN SETUP
 
 @jwt.user_identity_loader
 def user_identity_lookup(user):
-    return user.id
+    return str(user.id)
 
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
-    identity = jwt_data["sub"]
-    return User.query.filter_by(id=identity).one_or_none()
+    return load_current_user(jwt_data)
 
-@app.errorhandler(APIException)
 def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+    return jsonify(error.to_dict()), error.status_code, error.headers or {}
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return route_index_response()
+
+@api.route('/healthz')
+def healthz():
+    return health_response(db.engines)
     
-@app.route('/create-account', methods=['POST'])
+@api.route('/create-account', methods=['POST'])
+@limited("create_account", rate="10/minute", per="ip", concurrency=4)
 def create_account():
-    body=request.get_json()
+    body=request.get_json(silent=True)
 
     if body is None:
         return "The request body is null", 400
-    if 'username' not in body:
+    if not isinstance(body, dict):
+        return "The request body must be an object", 400
+    if not is_filled_string(body.get('username')):
         return "Empty username", 400
-    if 'email' not in body:
+    if not is_filled_string(body.get('email')):
         return "Empty email", 400
-    if 'password' not in body:
+    if not is_filled_string(body.get('password')):
         return "Empty password", 400
 
     user=User()
     user.username=body['username']
     user.email=body['email']
-    user.password=body['password']
+    user.set_password(body['password'])
     user.is_active=True
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException("Username or email already taken", status_code=409)
 
     response_body = {
         "msg": "Added user"
@@ -83,42 +191,125 @@ def create_account():
 
     return jsonify(response_body), 200
 
-@app.route("/login", methods=["POST"])
+@api.route("/accounts/bulk", methods=["POST"])
+@route_auth("admin")
+@limited("accounts_bulk", concurrency=1)
+def create_accounts_bulk():
+    #* JSON array, NDJSON (application/x-ndjson) or CSV (text/csv) body, imported on a background thread
+    if not is_admin_request(request):
+        raise APIException("Admin token required", status_code=403)
+    import_format = format_from_mimetype(request.mimetype)
+    path = spool_upload(request.stream, import_format)
+    job, created = import_jobs.submit(current_app._get_current_object(), path=path, import_format=import_format)
+    status_url = url_for(".create_accounts_bulk_status", job_id=job["id"])
+    if not created:
+        os.remove(path)
+        return jsonify(msg="An import is already running", job_id=job["id"], status_url=status_url), 409
+    return jsonify(job_id=job["id"], status_url=status_url), 202, {"Location": status_url}
+
+@api.route("/accounts/bulk/<job_id>", methods=["GET"])
+@route_auth("admin")
+def create_accounts_bulk_status(job_id):
+    if not is_admin_request(request):
+        raise APIException("Admin token required", status_code=403)
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise APIException("Unknown job", status_code=404)
+    return jsonify(job), 200
+
+@api.route("/login", methods=["POST"])
+@limited("login", rate="20/minute", per="ip", concurrency=8)
 def login():
-    username = request.json.get("username", None)
-    password = request.json.get("password", None)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not is_filled_string(body.get("username")) or not is_filled_string(body.get("password")):
+        raise APIException("username and password are required", status_code=400)
+    username = body["username"]
+    password = body["password"]
     user = User.query.filter_by(username=username).one_or_none()
-    
-    if not user or not user.check_password(password):
+
+    if user is None:
+        verify_unknown_user_pooled(password)
         return jsonify("Wrong username or password"), 401
-    
+    if not user.check_password(password):
+        return jsonify("Wrong username or password"), 401
+
+    #* Plaintext passwords and hashes made with older parameters are upgraded on a successful login
+    if user.password_needs_rehash():
+        user.set_password(password)
+        db.session.commit()
+
     expiration=timedelta(hours=80)
-    access_token = create_access_token(identity=user, expires_delta=expiration)
+    access_token = create_access_token(identity=user, additional_claims=identity_claims(user), expires_delta=expiration)
 
     return jsonify(access_token=access_token)
 
-@app.route("/load_data", methods=["GET"])
-def load_data():
-    #todo filtro que revisa
-    initial_loader()
-    return jsonify("Succesfully added the Data"), 200
+@api.route("/planets", methods=["GET"])
+def get_planets():
+    return catalog_response("planets")
+
+@api.route("/characters", methods=["GET"])
+def get_characters():
+    return catalog_response("characters")
 
-@app.route("/get-favorites" , methods=["GET"])
+@api.route("/search", methods=["GET"])
+def search_catalog():
+    return search_response()
+
+@api.route("/get-favorites" , methods=["GET"])
+@route_auth("jwt")
 @jwt_required()
 def get_favorites():
-    merged_lists=get_merged_lists(current_user.id)
-    return jsonify(merged_lists), 200
+    user_id=current_user.id
+    state=favorites_cache.get_or_load(user_id, lambda: load_favorites_state(user_id))
+    return favorites_response(state)
 
-@app.route("/update-favorites" , methods=["POST"])
+@api.route("/update-favorites" , methods=["POST"])
+@route_auth("jwt")
 @jwt_required()
+@limited("update_favorites", rate="60/minute", concurrency=16)
 def update_favorites_sm():
     user_payload=request.get_json()
-    updated_lists=update_favorites_lists(user_payload,current_user.id)
-    return jsonify("Succesfully updated databases", updated_lists), 200
+    expected_version=parse_expected_version(request.headers.get("If-Match"))
+    updated_lists, version=update_favorites_lists(user_payload,current_user.id,expected_version)
+    return jsonify("Succesfully updated databases", updated_lists), 200, {"ETag": favorites_etag(version)}
+
+@api.route("/favorites", methods=["PATCH"])
+@route_auth("jwt")
+@jwt_required()
+@limited("patch_favorites", rate="120/minute", concurrency=16)
+def patch_favorites():
+    #* [{"op": "add" | "remove", "category": "PLANET" | "CHARACTER", "id": 3}, ...]
+    user_payload=request.get_json()
+    expected_version=parse_expected_version(request.headers.get("If-Match"), user_payload)
+    changes=apply_favorite_operations(user_payload, current_user.id, expected_version)
+    return jsonify(changes), 200, {"ETag": favorites_etag(changes["version"])}
     
 
+@api.route("/export/favorites", methods=["GET"])
+@route_auth("jwt")
+@jwt_required()
+def export_favorites():
+    return favorites_export_response(current_user.id, request.args.get("format"))
+
+@api.route("/export/favorites/all", methods=["GET"])
+@route_auth("admin")
+def export_all_favorites():
+    #* Every user's favorites, meant for the data warehouse sync
+    if not is_admin_request(request):
+        raise APIException("Admin token required", status_code=403)
+    return favorites_export_response(None, request.args.get("format"))
+
+@api.route("/export/<category>", methods=["GET"])
+def export_catalog(category):
+    return catalog_export_response(category, request.args.get("format"))
+
+@api.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 #Just use for debugging purposes
-@app.route("/user_identity", methods=["GET"])
+@debug.route("/user_identity", methods=["GET"])
+@route_auth("jwt")
 @jwt_required()
 def protected():
     # We can now access our sqlalchemy User object via `current_user`.
@@ -130,4 +321,4 @@ def protected():
 
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -1,30 +1,39 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import safe_str_cmp
+from passwords import hash_password_pooled, verify_password_pooled, needs_rehash
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
-#todo hash and salt passwords
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     username = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=True)
+    #* Bumped by every write to the user's favorites, lets clients sync incrementally
+    favorites_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    #* UTC time of the last write to the favorites, sent as Last-Modified by /get-favorites
+    favorites_updated_at = db.Column(db.DateTime, nullable=True)
     favorites_planets= db.relationship('FavoritePlanet', backref='user', lazy=True)
     favorites_characters= db.relationship('FavoriteCharacter', backref='user', lazy=True)
 
     def __repr__(self):
         return '<User %s>' % self.username
 
+    # do not serialize the password, its a security breach
+    serialize_fields = ("id", "email")
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            # do not serialize the password, its a security breach
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
+
+    def set_password(self, password):
+        self.password = hash_password_pooled(password)
 
     def check_password(self, password):
-        return safe_str_cmp(password, self.password)
+        return verify_password_pooled(self.password, password)
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.password)
 
 class Character(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -42,18 +51,11 @@ class Character(db.Model):
     def __repr__(self):
         return '<Character %s>' % self.name
 
+    #* Declared once, serialize() and the precompiled encoders in encoders.py both read them
+    serialize_fields = ("id", "name", "birth_day", "gender", "height", "skin_color", "hair_color", "eye_color")
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "birth_day": self.birth_day,
-            "gender": self.gender,
-            "height": self.height,
-            "skin_color": self.skin_color,
-            "hair_color": self.hair_color,
-            "eye_color": self.eye_color,
-            # do not serialize the password, its a security breach
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class Planet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -72,39 +74,53 @@ class Planet(db.Model):
     def __repr__(self):
         return '<Planet %s>' % self.name
 
+    serialize_fields = ("id", "name", "climate", "population", "terrain", "rotation_period", "orbital_period", "diameter")
+
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "climate": self.climate,
-            "population": self.population,
-            "terrain": self.terrain,
-            "rotation_period": self.rotation_period,
-            "orbital_period": self.orbital_period,
-            "diameter": self.diameter,
-            # do not serialize the password, its a security breach
-        }
+        return {field: getattr(self, field) for field in self.serialize_fields}
 
 class FavoritePlanet (db.Model): # favorite_planet
     id = db.Column(db.Integer, primary_key=True)
     planet_id= db.Column(db.Integer,db.ForeignKey(Planet.local_id))
     user_id= db.Column(db.Integer,db.ForeignKey(User.id))
+    #* user_id leads the index so it also serves every filter_by(user_id=...)
+    __table_args__ = (db.Index('ix_favorite_planet_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
 
     def serialize(self):
-        planet_data=Planet.query.filter_by(id=self.planet_id).first()
+        from catalog import get_catalog #* imported here because catalog imports this module
+        planet_data=get_catalog().planets.get(self.planet_id)
         return {
             "id": self.planet_id,
-            "name": planet_data.name
+            "name": planet_data.name if planet_data else None
         }
 
 class FavoriteCharacter (db.Model): ## favorite_character
     id = db.Column(db.Integer, primary_key=True)
     character_id= db.Column(db.Integer,db.ForeignKey(Character.local_id))
     user_id= db.Column(db.Integer,db.ForeignKey(User.id))
+    __table_args__ = (db.Index('ix_favorite_character_user_id_character_id', 'user_id', 'character_id', unique=True),)
     
     def serialize(self):
-        character_data=Character.query.filter_by(id=self.character_id).first()
+        from catalog import get_catalog #* imported here because catalog imports this module
+        character_data=get_catalog().characters.get(self.character_id)
         return {
             "id": self.character_id,
-            "name": character_data.name
-        }
\ No newline at end of file
+            "name": character_data.name if character_data else None
+        }
+class BackgroundJob(db.Model): # background_job
+    """State of a job run by jobs.JobRunner, any worker can answer a status poll from it."""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    #* The kind while the job is queued or running and NULL afterwards, the unique index allows one active job per kind across workers
+    lock_key = db.Column(db.String(50), unique=True, nullable=True)
+    progress = db.Column(db.JSON, nullable=True)
+    errors = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    #* Written with the progress every JOB_HEARTBEAT_SECONDS while the job runs, a job that stops updating it is stale
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return '<BackgroundJob %s %s>' % (self.kind, self.id)
@@ -0,0 +1,75 @@
+"""
+Password hashing for User.
+The method and its cost are stored in every hash (werkzeug format method$salt$hash, e.g.
+pbkdf2:sha256:600000$...), so PASSWORD_HASH_METHOD can be changed at any time and the old
+hashes, plaintext ones included, are upgraded the next time their owner logs in.
+Hashing runs on a bounded pool so at most PASSWORD_HASH_WORKERS hashes burn CPU at once and
+the other threads of the worker keep serving requests.
+"""
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+
+HASH_PREFIXES = ("pbkdf2", "scrypt")
+
+_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method=method or PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
+
+
+def hash_method(stored_password):
+    """method part of the stored hash, None for legacy plaintext passwords."""
+    if "$" not in stored_password:
+        return None
+    method = stored_password.split("$", 1)[0]
+    return method if method.split(":", 1)[0] in HASH_PREFIXES else None
+
+
+@lru_cache(maxsize=8)
+def normalized_method(method):
+    #* werkzeug fills in the default cost when the method omits it, e.g. pbkdf2:sha256 -> pbkdf2:sha256:600000
+    return hash_method(generate_password_hash("", method=method, salt_length=1))
+
+
+def verify_password(stored_password, password):
+    if stored_password is None or password is None:
+        return False
+    if hash_method(stored_password) is None:
+        return hmac.compare_digest(stored_password.encode(), password.encode())
+    return check_password_hash(stored_password, password)
+
+
+def needs_rehash(stored_password, method=None):
+    return hash_method(stored_password) != normalized_method(method or PASSWORD_HASH_METHOD)
+
+
+def hash_password_pooled(password, method=None):
+    return _pool.submit(hash_password, password, method).result()
+
+
+def verify_password_pooled(stored_password, password):
+    return _pool.submit(verify_password, stored_password, password).result()
+
+
+@lru_cache(maxsize=1)
+def dummy_password_hash():
+    """Hash of a random password with PASSWORD_HASH_METHOD, computed once per process."""
+    return hash_password(os.urandom(16).hex())
+
+
+def verify_unknown_user_pooled(password):
+    """
+    Runs a verification that always fails at the cost of a real one, for logins of unknown usernames.
+    Without it a wrong password takes a full hash for an existing user and nothing for an unknown
+    one, and the response time tells which usernames exist.
+    """
+    verify_password_pooled(dummy_password_hash(), password)
+    return False
@@ -1,140 +1,288 @@
 from models import db, User,Character,Planet,FavoritePlanet,FavoriteCharacter
-
-import collections
+from utils import APIException
+from favorites_cache import favorites_cache
+from catalog import get_catalog
+from sql_helpers import insert_ignore
+from sqlalchemy import select, delete, update, literal, union_all
+from flask import request, jsonify, Response
+from werkzeug.http import http_date, is_resource_modified
+from datetime import datetime, timezone
+import calendar
 
 #!-----------------------------------------------------------------------------------------------------------------------------------Method to concatenate both serialized FavoriteCharacter and FavoritePlanet lists
-def get_merged_lists(current_user_id):
-    try:
-        favorite_character = FavoriteCharacter.query.filter_by(user_id=current_user_id)
-    except:
-        favorite_character=[]
-    try:
-        favorite_planet = FavoritePlanet.query.filter_by(user_id=current_user_id)
-    except:
-        favorite_character=[]
+def favorites_select(category, favorite_model, column_name, current_user_id):
+    #* Only the ids are read, the names are resolved against the in memory catalog
+    return (
+        select(
+            literal(category).label("category"),
+            favorite_model.id.label("favorite_id"),
+            getattr(favorite_model, column_name).label("local_id"),
+        )
+        .where(favorite_model.user_id == current_user_id)
+    )
+
+def serialize_favorite_ids(local_ids, catalog_table):
+    serialized = []
+    for local_id in local_ids:
+        record = catalog_table.get(local_id)
+        if record is not None:
+            serialized.append({"id": local_id, "name": record.name})
+    return serialized
 
-    favorite_planet_serial = list(map(lambda favorite: favorite.serialize(), favorite_planet))
-    favorite_character_serial = list(map(lambda favorite: favorite.serialize(), favorite_character))
-    merged_list=favorite_character_serial + favorite_planet_serial
+def get_merged_lists(current_user_id):
+    #* Characters first and then planets, both categories come back in a single UNION ALL round trip
+    merged_query = union_all(
+        favorites_select(0, FavoriteCharacter, "character_id", current_user_id),
+        favorites_select(1, FavoritePlanet, "planet_id", current_user_id),
+    ).order_by("category", "favorite_id")
+    rows = db.session.execute(merged_query).all()
+    catalog = get_catalog()
+    character_serial = serialize_favorite_ids([row.local_id for row in rows if row.category == 0], catalog.characters)
+    planet_serial = serialize_favorite_ids([row.local_id for row in rows if row.category == 1], catalog.planets)
+    merged_list = character_serial + planet_serial
     return merged_list
 
+#!-----------------------------------------------------------------------------------------------------------------------------------Versioning
+def favorites_etag(version):
+    return '"%d"' % version
+
+def utc_now():
+    #* Naive UTC, the column has no time zone. Whole seconds since HTTP dates have no fraction
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def favorites_state(version, updated_at, favorites):
+    """What favorites_cache keeps per user: the merged favorites with the version and time they correspond to."""
+    return {
+        "version": version,
+        "updated_at": calendar.timegm(updated_at.timetuple()) if updated_at is not None else None,
+        "favorites": favorites,
+    }
+
+def load_favorites_state(current_user_id):
+    #* The version is read before the lists, a write committed in between makes the lists newer than the version but never older
+    row = db.session.execute(
+        select(User.favorites_version, User.favorites_updated_at).where(User.id == current_user_id)
+    ).one()
+    return favorites_state(row.favorites_version, row.favorites_updated_at, get_merged_lists(current_user_id))
+
+def favorites_response(state):
+    """The favorites with ETag and Last-Modified, or an empty 304 when the client's copy is current."""
+    headers = {"ETag": favorites_etag(state["version"]), "Cache-Control": "private, no-cache"}
+    last_modified = None
+    if state["updated_at"] is not None:
+        last_modified = datetime.fromtimestamp(state["updated_at"], timezone.utc)
+        headers["Last-Modified"] = http_date(last_modified)
+    if not is_resource_modified(request.environ, etag=str(state["version"]), last_modified=last_modified):
+        return Response(status=304, headers=headers)
+    return jsonify(state["favorites"]), 200, headers
+
+def parse_expected_version(if_match, payload_from_request=None):
+    """Version the client based its write on, from If-Match or a version field in the body. None means unconditional."""
+    if if_match:
+        etag = if_match.strip()
+        if etag == "*":
+            return None
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        try:
+            return int(etag.strip('"'))
+        except ValueError:
+            raise APIException("If-Match must be the favorites version", status_code=400)
+    if isinstance(payload_from_request, dict) and payload_from_request.get("version") is not None:
+        try:
+            return int(payload_from_request["version"])
+        except (TypeError, ValueError):
+            raise APIException("version must be an integer", status_code=400)
+    return None
+
+def current_favorites_version(current_user_id):
+    return db.session.execute(select(User.favorites_version).where(User.id == current_user_id)).scalar_one()
+
+def claim_favorites_version(current_user_id, expected_version=None):
+    """
+    Bumps the favorites version as the first statement of a write. The UPDATE takes the user's row lock,
+    so concurrent writes of the same user run one after the other and each one reads what the previous committed.
+    With expected_version it is a compare and swap: a stale version rolls back and raises a 409 with the current state.
+    Returns the new version and the time it was written.
+    """
+    statement = update(User).where(User.id == current_user_id)
+    if expected_version is not None:
+        statement = statement.where(User.favorites_version == expected_version)
+    updated_at = utc_now()
+    result = db.session.execute(
+        statement.values(favorites_version=User.favorites_version + 1, favorites_updated_at=updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        raise APIException(
+            "The favorites changed since version %s" % expected_version,
+            status_code=409,
+            payload={"version": current_favorites_version(current_user_id), "favorites": get_merged_lists(current_user_id)},
+        )
+    if expected_version is not None:
+        return expected_version + 1, updated_at
+    return current_favorites_version(current_user_id), updated_at
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Set based reconciliation
+
+def unique_ids(id_list):
+    #* dict.fromkeys drops repeated ids in O(n) and keeps the order the user sent them
+    return list(dict.fromkeys(id_list))
+
+def reconcile_favorites(favorite_model, column_name, catalog_table, wanted_ids, current_user_id):
+    """
+    Makes the favorites of current_user_id in favorite_model match wanted_ids.
+    The add/remove sets are computed in memory and applied with one bulk DELETE and one
+    bulk INSERT that ignores conflicts, so the statement count does not depend on the payload size.
+    The caller owns the transaction. Returns the serialized favorites in the order get_merged_lists reads them back,
+    the order they were added in, so the cached payload and a fresh load of the same version are the same body,
+    and the number of rows that changed.
+    """
+    favorite_column = getattr(favorite_model, column_name)
+
+    #* One query for what the user has stored, the names come from the in memory catalog
+    stored_ids = list(db.session.execute(
+        select(favorite_column).where(favorite_model.user_id == current_user_id).order_by(favorite_model.id)
+    ).scalars())
+
+    #* Ids that are not in the catalog can not be favorites (the FK points to local_id)
+    wanted_ids = [item for item in wanted_ids if item in catalog_table]
+    wanted_set = set(wanted_ids)
+    stored_set = set(stored_ids)
+    ids_to_remove = stored_set.difference(wanted_set)
+    ids_to_add = [item for item in wanted_ids if item not in stored_set]
+    apply_favorite_changes(favorite_model, column_name, ids_to_add, ids_to_remove, current_user_id)
+
+    #* The kept rows keep their ids and the new ones get higher ids in insert order
+    kept_ids = [item for item in stored_ids if item in wanted_set]
+    return serialize_favorite_ids(kept_ids + ids_to_add, catalog_table), len(ids_to_add) + len(ids_to_remove)
+
+def apply_favorite_changes(favorite_model, column_name, ids_to_add, ids_to_remove, current_user_id):
+    #* At most one bulk DELETE and one bulk INSERT, whatever the number of ids
+    favorite_column = getattr(favorite_model, column_name)
+    if ids_to_remove:
+        db.session.execute(
+            delete(favorite_model)
+            .where(favorite_model.user_id == current_user_id, favorite_column.in_(ids_to_remove))
+            .execution_options(synchronize_session=False)
+        )
+    if ids_to_add:
+        #* A concurrent request may have added the same favorite, the unique index makes that a no-op
+        insert_ignore(favorite_model, [{"user_id": current_user_id, column_name: item} for item in ids_to_add])
+
 #!-----------------------------------------------------------------------------------------------------------------------------------Filters
 
 def update_filter_planet (planet_list,current_user_id):
-    #*Check if the FavoritePlanet table contains data if not, add the complete planet list
-    try:
-        #*----------------------------------------------------------------------------------Old Database Depuration
-        #* Check the old database state, if the old DB values are not in the ones from the Incoming Data then Delete them
-        favorite_planet = FavoritePlanet.query.filter_by(user_id=current_user_id)
-        serialized_items = list(map(lambda favorite: favorite.serialize(), favorite_planet))
-        for item in serialized_items:
-            if item['id'] not in planet_list:
-                #if old item in DB is not in the new list emitted by the user then erase it and update DB
-                item_to_delete  = FavoritePlanet.query.filter_by(user_id=current_user_id, planet_id=item['id']).first()
-                db.session.delete(item_to_delete)
-        db.session.commit()
-         #*END----------------------------------------------------------------------------------Old Database Depuration
-        
-        #* Once the database is depurated append the new values if they are not already included
-        new_favorite_planet = FavoritePlanet.query.filter_by(user_id=current_user_id)
-        new_serialized_items = list(map(lambda favorite: favorite.serialize(), new_favorite_planet))
-        new_serialized_items_dict =[]
-        for updated_db_item in new_serialized_items:
-            new_serialized_items_dict.append(updated_db_item['id'])
-        for new_item in planet_list:
-            if new_item not in new_serialized_items_dict:
-                item_to_add=FavoritePlanet(user_id=current_user_id, planet_id =new_item)
-                db.session.add(item_to_add)
-        db.session.commit()
-    except:
-        #!the DB favorite was empty proceed to insert all values in planet_list
-        for json_item in planet_list:
-            newPlanetFavorite = FavoritePlanet(user_id=current_user_id, planet_id = json_item)
-            db.session.add(newPlanetFavorite)
-        db.session.commit()
-
+    return reconcile_favorites(FavoritePlanet, "planet_id", get_catalog().planets, planet_list, current_user_id)
 
 def update_filter_character (character_list,current_user_id):
-
-    #*Check if the FavoriteCharacter table contains data if not, add the complete character list
-    try:
-        #*----------------------------------------------------------------------------------Old Database Depuration
-        #* Check the old database, if the old DB values are not in the ones from the Incoming Data then Deletethem
-        favorite_character = FavoriteCharacter.query.filter_by(user_id=current_user_id)
-        serialized_items = list(map(lambda favorite: favorite.serialize(), favorite_character))
-        for item in serialized_items:
-            print( item['id'])
-            print(character_list)
-            if item['id'] not in character_list:
-                print(True)
-                #if old item in DB is not in the new list emitted by the user then erase it and update DB
-                item_to_delete  = FavoriteCharacter.query.filter_by(user_id=current_user_id, character_id=item['id']).first()
-                db.session.delete(item_to_delete)
-
-        db.session.commit()
-        #*END----------------------------------------------------------------------------------Old Database Depuration
-        
-        
-        #* Once the database is depurated append the new values if they are not already included
-        new_favorite_character = FavoriteCharacter.query.filter_by(user_id=current_user_id)
-        new_serialized_items = list(map(lambda favorite: favorite.serialize(), new_favorite_character))
-        new_serialized_items_dict =[]
-        for updated_db_item in new_serialized_items:
-            new_serialized_items_dict.append(updated_db_item['id'])
-        for new_item in character_list:
-            if new_item not in new_serialized_items_dict:
-                item_to_add=FavoriteCharacter(user_id=current_user_id, character_id=new_item)
-                db.session.add(item_to_add)
-
-        db.session.commit()
-    except:
-        #the DB favorite was empty proceed to insert all values in planet_list
-        for json_item in character_list:
-            newCharacterFavorite = FavoriteCharacter(user_id=current_user_id, character_id = json_item)
-            db.session.add(newCharacterFavorite)
-        db.session.commit()
+    return reconcile_favorites(FavoriteCharacter, "character_id", get_catalog().characters, character_list, current_user_id)
 
 #!-----------------------------------------------------------------------------------------------------------------------------------End Filters
 
-#!-----------------------------------------------------------------------------------------------------------------------------------Main method that execute both filters and return the updated favorite data
-def update_favorites_lists (payload_from_request,current_user_id):
+def parse_favorites_payload(payload_from_request):
     planet_list=[]
     characters_list=[]
-    #if payload comes with data
+    if not isinstance(payload_from_request, list):
+        raise APIException("The request body must be a list of favorites", status_code=400)
     #this data can contain planets or characters or both
-    for json_item in payload_from_request:
-        # print(type(json_item['category']))
-        if (json_item['category'] == "PLANET"):
-            planet_list.append(json_item["planet_id"]) #[12,5,6,14] how it will look
-        if (json_item['category'] == "CHARACTER"):
-            characters_list.append(json_item["character_id"]) #[12,5,6,14] how it will look
-
-
-    if (len(planet_list)>0):
-        planet_list = [x for n, x in enumerate(planet_list) if x not in planet_list[:n]]
-        update_filter_planet(planet_list,current_user_id)
-
-    elif (len(planet_list)==0):
-        all_favorites=FavoritePlanet.query.filter_by(user_id=current_user_id)
-        all_favorites_serialize = list(map(lambda favorite: favorite.serialize(), all_favorites))
-        for item in all_favorites_serialize:
-            favorite_to_delete=FavoritePlanet.query.filter_by(user_id=current_user_id,planet_id=item['id']).first()
-            db.session.delete(favorite_to_delete)
-        
-        db.session.commit()
-
-    if (len(characters_list)>0):
-        character_list = [x for n, x in enumerate(characters_list) if x not in characters_list[:n]]
-        update_filter_character(characters_list,current_user_id)
-    elif (len(characters_list)==0):
-        all_favorites=FavoriteCharacter.query.filter_by(user_id=current_user_id)
-        all_favorites_serialize = list(map(lambda favorite: favorite.serialize(), all_favorites))
-        
-        for item in all_favorites_serialize:
-            favorite_to_delete=FavoriteCharacter.query.filter_by(user_id=current_user_id,character_id=item['id']).first()
-            db.session.delete(favorite_to_delete)
-        
-        db.session.commit()
-
-    updated_list = get_merged_lists(current_user_id)
-    return updated_list
\ No newline at end of file
+    try:
+        for json_item in payload_from_request:
+            if (json_item['category'] == "PLANET"):
+                planet_list.append(int(json_item["planet_id"])) #[12,5,6,14] how it will look
+            if (json_item['category'] == "CHARACTER"):
+                characters_list.append(int(json_item["character_id"])) #[12,5,6,14] how it will look
+    except (KeyError, TypeError, ValueError):
+        raise APIException("Every favorite needs a category and a numeric planet_id or character_id", status_code=400)
+    return unique_ids(planet_list), unique_ids(characters_list)
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Main method that execute both filters and return the updated favorite data
+def update_favorites_lists (payload_from_request,current_user_id,expected_version=None):
+    """Returns the merged favorites and the favorites version they correspond to."""
+    planet_list, characters_list = parse_favorites_payload(payload_from_request)
+
+    #* Both tables are reconciled inside a single transaction, an empty list removes every favorite of that category
+    try:
+        version, updated_at = claim_favorites_version(current_user_id, expected_version)
+        planet_serial, planets_changed = update_filter_planet(planet_list, current_user_id)
+        character_serial, characters_changed = update_filter_character(characters_list, current_user_id)
+        changed = planets_changed or characters_changed
+        if changed:
+            db.session.commit()
+        else:
+            #* Nothing changed, the version bump is undone so the clients' versions stay valid
+            db.session.rollback()
+            version -= 1
+    except Exception:
+        db.session.rollback()
+        raise
+
+    #* The merged list is built from the reconciliation result instead of querying the tables again
+    updated_list = character_serial + planet_serial
+    if changed:
+        favorites_cache.store(current_user_id, favorites_state(version, updated_at, updated_list))
+    return updated_list, version
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Delta operations
+FAVORITE_CATEGORIES = {
+    "PLANET": (FavoritePlanet, "planet_id", "planets"),
+    "CHARACTER": (FavoriteCharacter, "character_id", "characters"),
+}
+
+def parse_favorite_operations(payload_from_request):
+    """Returns {category: {id: "add" | "remove"}}, a later operation on the same favorite replaces an earlier one."""
+    operations = payload_from_request.get("operations") if isinstance(payload_from_request, dict) else payload_from_request
+    if not isinstance(operations, list):
+        raise APIException("The request body must be a list of operations", status_code=400)
+    net_operations = {category: {} for category in FAVORITE_CATEGORIES}
+    for operation in operations:
+        try:
+            op, category, item = operation["op"], operation["category"], int(operation["id"])
+        except (KeyError, TypeError, ValueError):
+            raise APIException("Every operation needs an op, a category and a numeric id", status_code=400)
+        if op not in ("add", "remove") or category not in FAVORITE_CATEGORIES:
+            raise APIException("op must be add or remove and category PLANET or CHARACTER", status_code=400)
+        net_operations[category][item] = op
+    return net_operations
+
+def apply_favorite_operations(payload_from_request, current_user_id, expected_version=None):
+    """
+    Applies add/remove operations in one transaction. Only the ids the operations touch are read,
+    so toggling one favorite costs the same whatever the size of the list.
+    Returns the favorites that actually changed and the new favorites version.
+    """
+    net_operations = parse_favorite_operations(payload_from_request)
+    catalog = get_catalog()
+    added = []
+    removed = []
+    try:
+        version, updated_at = claim_favorites_version(current_user_id, expected_version)
+        for category, (favorite_model, column_name, catalog_name) in FAVORITE_CATEGORIES.items():
+            operations = net_operations[category]
+            if not operations:
+                continue
+            catalog_table = getattr(catalog, catalog_name)
+            favorite_column = getattr(favorite_model, column_name)
+            stored_ids = set(db.session.execute(
+                select(favorite_column).where(favorite_model.user_id == current_user_id, favorite_column.in_(list(operations)))
+            ).scalars())
+            ids_to_add = [item for item, op in operations.items() if op == "add" and item not in stored_ids and item in catalog_table]
+            ids_to_remove = [item for item, op in operations.items() if op == "remove" and item in stored_ids]
+            apply_favorite_changes(favorite_model, column_name, ids_to_add, ids_to_remove, current_user_id)
+            added += [{"category": category, "id": item, "name": catalog_table.get(item).name} for item in ids_to_add]
+            removed += [{"category": category, "id": item} for item in ids_to_remove]
+
+        if added or removed:
+            db.session.commit()
+        else:
+            db.session.rollback()
+            version -= 1
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if added or removed:
+        favorites_cache.invalidate(current_user_id, version)
+    return {"added": added, "removed": removed, "version": version}
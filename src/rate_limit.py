@@ -0,0 +1,202 @@
+"""
+Rate limiting and admission control of the expensive endpoints.
+
+    @app.route("/login", methods=["POST"])
+    @limited("login", rate="20/minute", per="ip", concurrency=8)
+
+rate is a token bucket per user (the JWT identity, or the client IP for anonymous requests) or per IP:
+"20/minute" refills 20 tokens a minute and holds at most 20, "20/minute burst 5" holds at most 5.
+A request without a token gets a 429 with Retry-After. concurrency caps the requests of the route that
+run at once in the process, the ones above it get a 503 right away instead of queueing behind them,
+so a burst on one expensive route can not take every thread from the others.
+Both can be changed per endpoint without a deploy, RATE_LIMIT_LOGIN="50/minute" or
+CONCURRENCY_LIMIT_LOGIN=4 (0 turns the limit off), and RATE_LIMIT_ENABLED=false disables all of them.
+The buckets live in the process, set RATE_LIMIT_URL=redis://... to share them between workers.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from functools import wraps
+from flask import request
+from instrumentation import metrics
+from utils import APIException, request_identity
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+#* Number of proxies in front of the app that append to X-Forwarded-For (1 on Heroku), 0 trusts only the socket address
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Limit:
+    """A token bucket as GCRA: one request every interval seconds on average, with up to capacity at once."""
+    __slots__ = ("interval", "window")
+
+    def __init__(self, rate, capacity):
+        self.interval = 1.0 / rate
+        self.window = capacity * self.interval
+
+    @classmethod
+    def parse(cls, spec):
+        """ "N/period" or "N/period burst B", period being second, minute, hour or day."""
+        try:
+            amount, rest = spec.strip().split("/", 1)
+            period, _, burst = rest.partition(" burst ")
+            amount = float(amount)
+            capacity = float(burst) if burst else amount
+            return cls(amount / PERIODS[period.strip()], capacity)
+        except (KeyError, ValueError, ZeroDivisionError):
+            raise ValueError("Invalid rate limit %r, expected something like 20/minute or 20/minute burst 5" % spec)
+
+
+class MemoryBucketStore:
+    """
+    Buckets local to the worker process. GCRA keeps a single float per key, the time at which the bucket
+    would be full again, so a check is one dict lookup and a few float operations.
+    There is no lock: two threads checking the same key at the same instant can both be let in,
+    which costs one extra request now and then and halves the cost of every check.
+    """
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = {}
+
+    def take(self, key, interval, window):
+        """Returns 0 when the request may go on, otherwise the seconds until it would."""
+        now = self.clock()
+        full_at = self._buckets.get(key, now)
+        if full_at < now:
+            full_at = now
+        full_at += interval
+        if full_at - now > window:
+            return full_at - now - window
+        if len(self._buckets) >= self.max_keys and key not in self._buckets:
+            self._evict(now)
+        self._buckets[key] = full_at
+        return 0.0
+
+    def _evict(self, now):
+        #* A bucket that refilled is the same as no bucket, those go first
+        self._buckets = {key: full_at for key, full_at in self._buckets.items() if full_at > now}
+        if len(self._buckets) >= self.max_keys:
+            self._buckets = {}
+
+    def clear(self):
+        self._buckets = {}
+
+
+class RedisBucketStore:
+    """Buckets shared by every worker, each check is one atomic script call timed with the Redis clock."""
+
+    SCRIPT = """
+        local interval, window = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local full_at = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now) + interval
+        if full_at - now > window then
+            return tostring(full_at - now - window)
+        end
+        redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+        return '0'
+    """
+
+    def __init__(self, client, prefix="rate-limit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    @classmethod
+    def from_url(cls, url):
+        #* redis is optional, it is only needed when RATE_LIMIT_URL is set
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, interval, window):
+        redis_key = self.prefix + ":".join(str(part) for part in key)
+        return float(self._script(keys=[redis_key], args=[interval, window]))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+def store_from_env():
+    url = os.environ.get('RATE_LIMIT_URL')
+    return RedisBucketStore.from_url(url) if url else MemoryBucketStore()
+
+
+bucket_store = store_from_env()
+metrics.describe("rate_limited_requests_total", "counter", "Requests rejected by a rate or concurrency limit")
+
+
+def client_ip():
+    if RATE_LIMIT_TRUSTED_PROXIES:
+        #* Every trusted proxy appends the address it got the request from, the client's is the one the outermost appended,
+        #* whatever the client wrote before it
+        route = request.access_route
+        if len(route) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return route[-RATE_LIMIT_TRUSTED_PROXIES]
+        return route[0]
+    return request.remote_addr
+
+
+def subject(per):
+    if per == "user":
+        identity = request_identity()
+        if identity is not None:
+            return "user", identity
+    return "ip", client_ip()
+
+
+def retry_after_header(seconds):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+def check_rate(name, limit, per):
+    key = (name,) + subject(per)
+    try:
+        retry_after = bucket_store.take(key, limit.interval, limit.window)
+    except Exception:
+        #* A broken shared store must not take the API down with it, the request goes through
+        logger.exception("Rate limit store failed")
+        return
+    if retry_after:
+        metrics.increment("rate_limited_requests_total", endpoint=name, reason="rate")
+        raise APIException("Too many requests, retry in %d seconds" % max(1, math.ceil(retry_after)),
+                           status_code=429, headers=retry_after_header(retry_after))
+
+
+def limited(name, rate=None, per="user", concurrency=None):
+    """Decorator applying the rate and concurrency limits of one endpoint, see the module docstring."""
+    spec = os.environ.get("RATE_LIMIT_%s" % name.upper(), rate)
+    limit = Limit.parse(spec) if spec else None
+    max_in_flight = int(os.environ.get("CONCURRENCY_LIMIT_%s" % name.upper(), concurrency or 0))
+    in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def decorator(view):
+        if not RATE_LIMIT_ENABLED:
+            return view
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if limit is not None:
+                check_rate(name, limit, per)
+            if in_flight is None:
+                return view(*args, **kwargs)
+            if not in_flight.acquire(blocking=False):
+                metrics.increment("rate_limited_requests_total", endpoint=name, reason="concurrency")
+                raise APIException("Too many concurrent requests, retry shortly", status_code=503, headers=retry_after_header(1))
+            try:
+                return view(*args, **kwargs)
+            finally:
+                in_flight.release()
+        #* Listed by the JSON route index
+        wrapper.rate_limit = spec
+        wrapper.concurrency_limit = max_in_flight or None
+        return wrapper
+    return decorator
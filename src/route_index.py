@@ -0,0 +1,57 @@
+"""
+The route index served by /. It is built once per app, the first time it is asked for, and kept as
+encoded bytes with their ETag: an HTML page for browsers and a JSON list of every route with its
+methods, the authentication it needs and its rate limit for everything else (?format=json or Accept: application/json).
+"""
+from flask import Response, current_app, request
+from werkzeug.http import generate_etag
+from encoders import dumps
+from utils import generate_sitemap
+
+CACHE_MAX_AGE = 300
+IGNORED_METHODS = {"HEAD", "OPTIONS"}
+
+
+def route_entries(app):
+    entries = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if rule.endpoint == "static" or rule.rule.startswith("/admin/"):
+            continue
+        view = app.view_functions[rule.endpoint]
+        entries.append({
+            "path": rule.rule,
+            "methods": sorted(rule.methods - IGNORED_METHODS),
+            "endpoint": rule.endpoint,
+            "auth": getattr(view, "route_auth", None),
+            "rate_limit": getattr(view, "rate_limit", None),
+            "concurrency_limit": getattr(view, "concurrency_limit", None),
+        })
+    return entries
+
+
+def build_route_index(app):
+    html = generate_sitemap(app).encode()
+    json_body = dumps({"routes": route_entries(app)})
+    return {
+        "text/html": (html, generate_etag(html)),
+        "application/json": (json_body, generate_etag(json_body)),
+    }
+
+
+def route_index_response():
+    app = current_app._get_current_object()
+    route_index = app.extensions.get("route_index")
+    if route_index is None:
+        route_index = app.extensions["route_index"] = build_route_index(app)
+
+    if request.args.get("format") == "json":
+        mimetype = "application/json"
+    else:
+        mimetype = request.accept_mimetypes.best_match(("text/html", "application/json"), default="text/html")
+    body, etag = route_index[mimetype]
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.vary.add("Accept")
+    return response.make_conditional(request)
@@ -0,0 +1,292 @@
+"""
+Type ahead search over the catalog, GET /search?q=desert or ?q=sky&type=planets.
+
+Every word of the indexed fields goes into a trie, whose terminal nodes hold the postings of the word:
+the planets and characters it appears in, with the weight of the best field it appears in.
+Each word of the query matches every indexed word it is a prefix of, a result has to match all the words
+of the query and is ranked by the sum of their weights, a whole word counting more than a prefix.
+
+The index follows the catalog snapshot: after a reload only the records whose indexed fields changed
+are removed and added again, so a /load_data run that touched a few rows costs a few trie updates.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from operator import itemgetter
+from flask import request, Response
+from werkzeug.http import generate_etag
+from utils import APIException
+from catalog import get_catalog, on_reload
+from catalog_handlers import parse_int_arg, CACHE_MAX_AGE
+from encoders import dumps
+from favorites_cache import MemoryBackend
+
+logger = logging.getLogger(__name__)
+
+#* Indexed fields of each category and their weight in the ranking
+SEARCH_FIELDS = {
+    "planets": {"name": 3.0, "terrain": 1.5, "climate": 1.5},
+    "characters": {"name": 3.0, "gender": 1.0, "hair_color": 1.0, "skin_color": 1.0, "eye_color": 1.0},
+}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_QUERY_WORDS = 8
+#* A prefix weighs between PREFIX_WEIGHT and 1 of the whole word, depending on how much of the word it covers
+PREFIX_WEIGHT = 0.5
+#* Prefixes with at least this many trie nodes under them keep their scores on the node until a word under it changes,
+#* the shorter the prefix the more of the index it matches
+SCORES_CACHE_NODES = 64
+#* Scores are kept in thousandths and sorted as one integer with the name rank of the record: -score * RANK_SPAN + rank
+RANK_SPAN = 1 << 32
+
+WORD = re.compile(r"\w+")
+
+
+def words(text):
+    return WORD.findall(text.casefold()) if text else []
+
+
+class TrieNode:
+    """postings is {field weight: set of local_ids} on the nodes that end a word, None elsewhere."""
+    __slots__ = ("children", "postings", "depth", "scores")
+
+    def __init__(self, depth=0):
+        self.children = {}
+        self.postings = None
+        self.depth = depth
+        self.scores = None
+
+
+class SearchIndex:
+    def __init__(self, fields=SEARCH_FIELDS):
+        self.fields = fields
+        self.snapshot = None
+        #* One trie per category, so ?type= only walks the ones it asks for
+        self._roots = {category: TrieNode() for category in fields}
+        self._names = {category: {} for category in fields}
+        #* Position of every record in the name order of the whole catalog, the tie breaker of the ranking
+        self._order = {category: {} for category in fields}
+        self._ranked = []
+        self._terms = 0
+        self._lock = threading.Lock()
+
+    #!-------------------------------------------------------------------------------------------------------------------------------Indexing
+    def document_terms(self, category, record):
+        """{word: weight} of one record, a word found in several fields keeps its best weight."""
+        terms = {}
+        for field, weight in self.fields[category].items():
+            value = getattr(record, field)
+            for word in words(value if isinstance(value, str) else None):
+                if terms.get(word, 0) < weight:
+                    terms[word] = weight
+        return terms
+
+    def indexed_values(self, category, record):
+        return tuple(getattr(record, field) for field in self.fields[category])
+
+    def _add(self, category, record):
+        local_id = record.local_id
+        self._names[category][local_id] = record.name
+        for word, weight in self.document_terms(category, record).items():
+            node = self._roots[category]
+            for char in word:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = TrieNode(node.depth + 1)
+                node = child
+                node.scores = None
+            if node.postings is None:
+                node.postings = {}
+                self._terms += 1
+            node.postings.setdefault(weight, set()).add(local_id)
+
+    def _remove(self, category, record):
+        local_id = record.local_id
+        self._names[category].pop(local_id, None)
+        for word, weight in self.document_terms(category, record).items():
+            path = [self._roots[category]]
+            for char in word:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                path.append(node)
+                node.scores = None
+            else:
+                node = path[-1]
+                if node.postings is not None and weight in node.postings:
+                    node.postings[weight].discard(local_id)
+                    if not node.postings[weight]:
+                        del node.postings[weight]
+                    if not node.postings:
+                        node.postings = None
+                        self._terms -= 1
+                #* Prunes the branch of a word no record uses anymore
+                for depth in range(len(word), 0, -1):
+                    node = path[depth]
+                    if node.postings is not None or node.children:
+                        break
+                    del path[depth - 1].children[word[depth - 1]]
+
+    def sync(self, snapshot):
+        """Brings the index to the given catalog snapshot, touching only the records that changed."""
+        with self._lock:
+            current = self.snapshot
+            if snapshot is current:
+                return
+            if current is not None and (snapshot.loaded_at or 0) < (current.loaded_at or 0):
+                #* A slower reload finished after a newer one, its snapshot is already outdated
+                return
+            started = time.perf_counter()
+            added = removed = 0
+            for category in self.fields:
+                new_table = getattr(snapshot, category)
+                old_table = getattr(current, category) if current is not None else None
+                for record in old_table or ():
+                    new_record = new_table.get(record.local_id)
+                    if new_record is None or self.indexed_values(category, new_record) != self.indexed_values(category, record):
+                        self._remove(category, record)
+                        removed += 1
+                for record in new_table:
+                    old_record = old_table.get(record.local_id) if old_table is not None else None
+                    if old_record is None or self.indexed_values(category, old_record) != self.indexed_values(category, record):
+                        self._add(category, record)
+                        added += 1
+            if added or removed:
+                self._rank_names()
+            self.snapshot = snapshot
+            search_results.clear()
+        logger.info("Search index synced in %.1fms: %d records added, %d removed, %d words",
+                    (time.perf_counter() - started) * 1000, added, removed, self._terms)
+
+    def _rank_names(self):
+        self._ranked = sorted(((name or "").casefold(), category, local_id, name)
+                              for category, names in self._names.items() for local_id, name in names.items())
+        self._order = {category: {} for category in self.fields}
+        for rank, (_, category, local_id, _) in enumerate(self._ranked):
+            self._order[category][local_id] = rank
+
+    #!-------------------------------------------------------------------------------------------------------------------------------Search
+    def _word_scores(self, root, word):
+        """{local_id: score} of the records with a word starting with word, the best of their words counts."""
+        prefix = root
+        for char in word:
+            prefix = prefix.children.get(char)
+            if prefix is None:
+                return {}
+        if prefix.scores is not None:
+            return prefix.scores
+        length = len(word)
+        groups = []
+        stack = [prefix]
+        visited = 0
+        while stack:
+            node = stack.pop()
+            visited += 1
+            if node.postings is not None:
+                match = 1.0 if node.depth == length else PREFIX_WEIGHT + (1 - PREFIX_WEIGHT) * length / node.depth
+                for weight, local_ids in node.postings.items():
+                    groups.append((round(weight * match * 1000), local_ids))
+            stack.extend(node.children.values())
+        #* Lowest scores first so that the best one of every record is written last, one bulk update per group
+        groups.sort(key=itemgetter(0))
+        scores = {}
+        for score, local_ids in groups:
+            scores.update(dict.fromkeys(local_ids, score))
+        if visited >= SCORES_CACHE_NODES:
+            prefix.scores = scores
+        return scores
+
+    def _category_totals(self, category, query_words):
+        root = self._roots[category]
+        totals = None
+        #* The intersection starts from the word with the fewest matches, so it only shrinks from there
+        for scores in sorted((self._word_scores(root, word) for word in query_words), key=len):
+            if totals is None:
+                totals = scores
+            else:
+                totals = {local_id: totals[local_id] + scores[local_id] for local_id in totals.keys() & scores.keys()}
+            if not totals:
+                return {}
+        return totals
+
+    def search(self, query, categories=None, limit=DEFAULT_LIMIT):
+        """[(score, category, local_id, name)] of the best matches of query, best first."""
+        query_words = list(dict.fromkeys(words(query)))[:MAX_QUERY_WORDS]
+        if not query_words:
+            return []
+        with self._lock:
+            candidates = []
+            for category in categories or self.fields:
+                totals = self._category_totals(category, query_words)
+                order = self._order[category]
+                if len(totals) > limit:
+                    #* Only the records that can make it to the page are sorted
+                    threshold = heapq.nlargest(limit, totals.values())[-1]
+                    candidates.extend([order[local_id] - score * RANK_SPAN for local_id, score in totals.items() if score >= threshold])
+                else:
+                    candidates.extend([order[local_id] - score * RANK_SPAN for local_id, score in totals.items()])
+            candidates.sort()
+            ranked = self._ranked
+            return [(-(key // RANK_SPAN) / 1000,) + ranked[key % RANK_SPAN][1:] for key in candidates[:limit]]
+
+    def stats(self):
+        return {"documents": len(self._ranked), "words": self._terms}
+
+
+search_index = SearchIndex()
+#* Encoded responses of the latest queries, they only change when the index does
+search_results = MemoryBackend(max_entries=2048, ttl=24 * 3600)
+
+
+@on_reload
+def sync_search_index(old_snapshot, new_snapshot):
+    search_index.sync(new_snapshot)
+
+
+#!-----------------------------------------------------------------------------------------------------------------------------------Response
+def parse_categories(args):
+    value = args.get("type")
+    if not value:
+        return tuple(SEARCH_FIELDS)
+    categories = tuple(dict.fromkeys(category.strip() for category in value.split(",") if category.strip()))
+    unknown = [category for category in categories if category not in SEARCH_FIELDS]
+    if unknown:
+        raise APIException("Unknown type: %s, expected planets or characters" % ", ".join(unknown), status_code=400)
+    return categories
+
+
+def encode_results(query, results):
+    return dumps({
+        "q": query,
+        "results": [{"type": category, "local_id": local_id, "name": name, "score": score}
+                    for score, category, local_id, name in results],
+    }) + b"\n"
+
+
+def search_response():
+    query = (request.args.get("q") or "").strip()
+    if not words(query):
+        raise APIException("q is required, for example /search?q=desert", status_code=400)
+    categories = parse_categories(request.args)
+    limit = parse_int_arg(request.args, "limit", DEFAULT_LIMIT, minimum=1, maximum=MAX_LIMIT)
+
+    catalog = get_catalog()
+    if search_index.snapshot is not catalog:
+        #* The catalog was loaded before this module registered its hook
+        search_index.sync(catalog)
+
+    cache_key = (catalog.loaded_at, query, categories, limit)
+    encoded = search_results.get(cache_key)
+    if encoded is None:
+        body = encode_results(query, search_index.search(query, categories, limit))
+        encoded = (body, generate_etag(body))
+        search_results.set(cache_key, encoded)
+    body, etag = encoded
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response.make_conditional(request)
@@ -0,0 +1,127 @@
+"""
+Small helpers around SQLAlchemy that are shared by the handlers and the benchmarks
+"""
+from contextlib import contextmanager
+from sqlalchemy import event, select, update, bindparam
+
+
+class QueryCounter:
+    """Records every statement the engine sends to the database while it is active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def assert_num_queries(expected, engine=None, exact=True):
+    """
+    Fails when the block runs a different number of statements than expected,
+    use exact=False to only pin an upper bound. A bulk executemany counts as one statement.
+    """
+    if engine is None:
+        from models import db
+        engine = db.engine
+    with QueryCounter(engine) as counter:
+        yield counter
+    too_many = counter.count > expected
+    if too_many or (exact and counter.count != expected):
+        raise AssertionError(
+            "Expected %s%d queries, got %d:\n%s" % (
+                "" if exact else "at most ", expected, counter.count, "\n".join(counter.statements)
+            )
+        )
+
+
+def dialect_insert(table, dialect_name):
+    """Insert construct of the dialect, so the ON CONFLICT / ON DUPLICATE KEY clauses are available."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
+
+
+def upsert_rows(model, rows, key, session=None):
+    """
+    Inserts rows or updates the ones whose unique column key already exists, with one bulk statement
+    on PostgreSQL, MySQL and SQLite. The caller owns the transaction. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    if session is None:
+        from models import db
+        session = db.session
+    table = model.__table__
+    dialect_name = session.get_bind().dialect.name
+    update_columns = [column for column in rows[0] if column != key]
+    statement = dialect_insert(table, dialect_name)
+
+    if dialect_name == "mysql":
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in update_columns})
+    elif statement is not None:
+        statement = statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: statement.excluded[column] for column in update_columns},
+        )
+    else:
+        #* Generic fallback: one query for the existing keys, then one bulk UPDATE and one bulk INSERT
+        existing_keys = set(session.execute(
+            select(table.c[key]).where(table.c[key].in_([row[key] for row in rows]))
+        ).scalars())
+        updates = [dict(row, _key=row[key]) for row in rows if row[key] in existing_keys]
+        if updates:
+            session.execute(
+                update(table).where(table.c[key] == bindparam("_key"))
+                .values({column: bindparam(column) for column in update_columns}),
+                updates,
+            )
+        rows = [row for row in rows if row[key] not in existing_keys]
+        if not rows:
+            return len(updates)
+        session.execute(table.insert(), rows)
+        return len(updates) + len(rows)
+
+    session.execute(statement, rows)
+    return len(rows)
+
+
+def insert_ignore(model, rows, session=None):
+    """
+    Bulk inserts rows skipping the ones that hit a unique constraint: ON CONFLICT DO NOTHING on
+    PostgreSQL and SQLite, INSERT IGNORE on MySQL and a plain INSERT elsewhere. The caller owns the transaction.
+    """
+    if not rows:
+        return
+    if session is None:
+        from models import db
+        session = db.session
+    table = model.__table__
+    dialect_name = session.get_bind().dialect.name
+    statement = dialect_insert(table, dialect_name)
+    if dialect_name == "mysql":
+        statement = statement.prefix_with("IGNORE")
+    elif statement is not None:
+        statement = statement.on_conflict_do_nothing()
+    else:
+        statement = table.insert()
+    session.execute(statement, rows)
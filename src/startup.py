@@ -0,0 +1,45 @@
+"""
+Cost of building the app, per component, so the cold start of a worker can be followed over time.
+create_app wraps every import and initialization step in report.step(name), logs the summary and
+publishes it in /metrics as app_startup_seconds.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.steps = []
+        self.total = None
+
+    @contextmanager
+    def step(self, component):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((component, time.perf_counter() - started))
+
+    def add(self, component, seconds):
+        self.steps.append((component, seconds))
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        logger.info(self.summary())
+        return self
+
+    def summary(self):
+        parts = ", ".join("%s %.0fms" % (component, seconds * 1000) for component, seconds in self.steps)
+        return "App built in %.0fms: %s" % ((self.total or 0.0) * 1000, parts)
+
+    def to_dict(self):
+        return {"total_seconds": self.total, "steps": [{"component": component, "seconds": seconds} for component, seconds in self.steps]}
+
+    def gauge_values(self):
+        values = {(("component", component),): round(seconds, 6) for component, seconds in self.steps}
+        values[(("component", "total"),)] = round(self.total or 0.0, 6)
+        return values
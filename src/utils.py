@@ -1,14 +1,18 @@
-from flask import jsonify, url_for
+import hmac
+import os
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
 
 class APIException(Exception):
     status_code = 400
 
-    def __init__(self, message, status_code=None, payload=None):
+    def __init__(self, message, status_code=None, payload=None, headers=None):
         Exception.__init__(self)
         self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.payload = payload
+        self.headers = headers
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -20,17 +24,21 @@ def has_no_empty_params(rule):
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
-def generate_sitemap(app):
-    links = ['/admin/']
+def sitemap_links(app):
+    #* Built with the url map itself instead of url_for, so no request is needed
+    adapter = app.url_map.bind("")
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
         if "GET" in rule.methods and has_no_empty_params(rule):
-            url = url_for(rule.endpoint, **(rule.defaults or {}))
+            url = adapter.build(rule.endpoint, rule.defaults or {})
             if "/admin/" not in url:
                 links.append(url)
+    return links
 
-    links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in links])
+def generate_sitemap(app):
+    links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in sitemap_links(app)])
     return """
         <div style="text-align: center;">
         <img style="max-height: 80px" src='https://ucarecdn.com/3a0e7d8b-25f3-4e2f-add2-016064b04075/rigobaby.jpg' />
@@ -39,3 +47,32 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://github.com/4GeeksAcademy/flask-rest-hello/blob/master/docs/_QUICK_START.md" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+def route_auth(kind):
+    """Marks the authentication a view needs, "jwt" or "admin", for the JSON route index."""
+    def decorator(view):
+        view.route_auth = kind
+        return view
+    return decorator
+
+def is_filled_string(value):
+    #* JSON bodies can carry any type, the password hashing only accepts strings
+    return isinstance(value, str) and value.strip() != ""
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+def is_admin_request(request):
+    #* Admin only features are enabled by sending the ADMIN_TOKEN environment value in the X-Admin-Token header
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    sent_token = request.headers.get('X-Admin-Token')
+    if not admin_token or not sent_token:
+        return False
+    return hmac.compare_digest(admin_token.encode(), sent_token.encode())
+
+def request_identity():
+    """JWT identity of the current request, None when the request did not go through jwt_required."""
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
@@ -0,0 +1,86 @@
+"""
+The app under test runs on a throwaway SQLite file, without the optional admin, loader and migrations.
+src/ is imported the way wsgi.py does it, as top level modules.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+DATABASE_DIR = tempfile.mkdtemp(prefix="flask-endpoints-tests-")
+sys.path.insert(0, SRC_DIR)
+#* Several modules read their configuration at import time
+os.environ["DB_CONNECTION_STRING"] = "sqlite:///" + os.path.join(DATABASE_DIR, "test.db")
+os.environ.setdefault("FLASK_APP_KEY", "test key, long enough for the HS256 tokens")
+#* Real hash costs would make every user fixture take a third of a second
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+TEST_CONFIG = {
+    "TESTING": True,
+    "ENABLE_ADMIN": False,
+    "ENABLE_LOADER": False,
+    "ENABLE_MIGRATE": False,
+    "PRELOAD_CATALOG": False,
+}
+
+
+@pytest.fixture(scope="session")
+def app():
+    from main import create_app
+    return create_app(TEST_CONFIG)
+
+
+@pytest.fixture
+def db(app):
+    from models import db
+    from catalog import reload_catalog
+    from favorites_cache import favorites_cache
+    from auth import active_users
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        reload_catalog()
+        favorites_cache.backend.clear()
+        active_users.backend.clear()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def seed_catalog(db):
+    """Adds planets and characters 1..count and reloads the catalog."""
+    from models import Planet, Character
+    from catalog import reload_catalog
+
+    def seed(count):
+        for local_id in range(1, count + 1):
+            db.session.add(Planet(local_id=local_id, name="Planet %d" % local_id, climate="arid", terrain="desert"))
+            db.session.add(Character(local_id=local_id, name="Character %d" % local_id, gender="n/a"))
+        db.session.commit()
+        reload_catalog()
+    return seed
+
+
+@pytest.fixture
+def user(db):
+    from models import User
+    from passwords import hash_password
+    user = User(username="luke", email="luke@example.com", password=hash_password("correct horse"), is_active=True)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def auth_headers(app, user):
+    from flask_jwt_extended import create_access_token
+    from auth import identity_claims
+    token = create_access_token(identity=user, additional_claims=identity_claims(user))
+    return {"Authorization": "Bearer " + token}
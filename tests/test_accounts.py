@@ -0,0 +1,45 @@
+import glob
+import json
+import os
+import tempfile
+import accounts
+from models import User
+from passwords import hash_password
+from test_jobs import wait_for
+
+
+def test_bulk_import_runs_as_a_job_and_stops_the_hash_pool(client, db, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "admin token")
+    rows = [
+        {"username": "leia", "email": "leia@example.com", "password": "alderaan"},
+        {"username": "han", "email": "han@example.com", "password_hash": hash_password("falcon")},
+        {"username": "leia", "email": "other@example.com", "password": "again"},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post("/accounts/bulk", data=body, content_type="application/x-ndjson",
+                           headers={"X-Admin-Token": "admin token"})
+    assert response.status_code == 202
+    assert response.headers["Location"] == response.json["status_url"]
+
+    job = wait_for(accounts.import_jobs, response.json["job_id"], "succeeded", timeout=30)
+    assert (job["rows_read"], job["created"], job["failed"]) == (3, 2, 1)
+    assert job["failed_rows"][0]["error"] == "username repeated in the import"
+    assert accounts._hash_pool is None
+    db.session.expire_all()
+    assert User.query.filter_by(username="leia").one().check_password("alderaan")
+
+    status = client.get(response.json["status_url"], headers={"X-Admin-Token": "admin token"})
+    assert status.status_code == 200 and status.json["status"] == "succeeded"
+    assert client.get(response.json["status_url"]).status_code == 403
+
+
+def test_invalid_upload_fails_the_job_and_removes_the_file(client, db, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "admin token")
+    spooled = os.path.join(tempfile.gettempdir(), "accounts-import-*")
+    before = set(glob.glob(spooled))
+
+    response = client.post("/accounts/bulk", data="not json", content_type="application/json",
+                           headers={"X-Admin-Token": "admin token"})
+    job = wait_for(accounts.import_jobs, response.json["job_id"], "failed")
+    assert job["errors"] == ["ValueError: The body is not valid JSON"]
+    assert set(glob.glob(spooled)) == before
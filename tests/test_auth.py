@@ -0,0 +1,22 @@
+from auth import active_users
+
+
+def test_deactivating_a_user_locks_out_their_token(client, db, user, auth_headers):
+    assert client.get("/get-favorites", headers=auth_headers).status_code == 200
+    assert active_users.backend.get(user.id) is True
+
+    user.is_active = False
+    db.session.commit()
+    assert client.get("/get-favorites", headers=auth_headers).status_code == 401
+
+    user.is_active = True
+    db.session.commit()
+    assert client.get("/get-favorites", headers=auth_headers).status_code == 200
+
+
+def test_a_rolled_back_change_keeps_the_cache(client, db, user, auth_headers):
+    client.get("/get-favorites", headers=auth_headers)
+    user.is_active = False
+    db.session.flush()
+    db.session.rollback()
+    assert active_users.backend.get(user.id) is True
@@ -0,0 +1,31 @@
+import catalog
+from catalog import reload_catalog, get_catalog, on_reload, _reload_listeners
+
+
+def test_reload_without_changes_keeps_the_snapshot_and_the_caches(db, seed_catalog):
+    from models import Planet
+    seed_catalog(3)
+    calls = []
+    listener = on_reload(lambda old_snapshot, new_snapshot: calls.append(new_snapshot))
+    try:
+        snapshot = get_catalog()
+        loaded_at = snapshot.loaded_at
+        assert reload_catalog() is snapshot
+        assert snapshot.loaded_at == loaded_at
+        assert catalog.last_refresh_at >= loaded_at
+        assert calls == []
+
+        db.session.get(Planet, 1).terrain = "swamp"
+        db.session.commit()
+        assert reload_catalog() is not snapshot
+        assert len(calls) == 1
+        assert get_catalog().planets.get(1).terrain == "swamp"
+    finally:
+        _reload_listeners.remove(listener)
+
+
+def test_get_catalog_does_not_query_once_loaded(db, seed_catalog):
+    from sql_helpers import assert_num_queries
+    seed_catalog(3)
+    with assert_num_queries(0):
+        assert len(get_catalog().planets) == 3
@@ -0,0 +1,58 @@
+import pytest
+
+
+def test_planets_are_paged_by_cursor(client, seed_catalog):
+    seed_catalog(5)
+    first = client.get("/planets?limit=2").json
+    assert [planet["id"] for planet in first["results"]] == [1, 2]
+    assert first["next_cursor"] == 2
+
+    second = client.get("/planets?limit=2&after=%d" % first["next_cursor"]).json
+    assert [planet["id"] for planet in second["results"]] == [3, 4]
+    last = client.get("/planets?limit=2&after=%d" % second["next_cursor"]).json
+    assert [planet["id"] for planet in last["results"]] == [5]
+    assert last["next_cursor"] is None
+
+
+def test_filters_and_fields(client, db, seed_catalog):
+    from models import Planet, Character
+    from catalog import reload_catalog
+    seed_catalog(4)
+    db.session.get(Planet, 2).terrain = "Mountains, Desert"
+    db.session.get(Planet, 3).terrain = "swamp"
+    db.session.get(Character, 4).gender = "female"
+    db.session.commit()
+    reload_catalog()
+
+    desert = client.get("/planets?terrain=DESERT&fields=id,name").json["results"]
+    assert desert == [{"id": 1, "name": "Planet 1"}, {"id": 2, "name": "Planet 2"}, {"id": 4, "name": "Planet 4"}]
+    females = client.get("/characters?gender=female").json["results"]
+    assert [character["id"] for character in females] == [4]
+    #* Only the filters of the category apply
+    assert len(client.get("/characters?terrain=swamp").json["results"]) == 4
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=ten", "after=x", "fields=id,mass"])
+def test_invalid_query_strings_are_400(client, seed_catalog, query):
+    seed_catalog(2)
+    assert client.get("/planets?" + query).status_code == 400
+
+
+def test_etag_revalidation_and_reload(client, db, seed_catalog):
+    from models import Planet
+    from catalog import reload_catalog
+    seed_catalog(3)
+    response = client.get("/planets")
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert "max-age=300" in response.headers["Cache-Control"]
+
+    not_modified = client.get("/planets", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.get_data() == b""
+
+    db.session.get(Planet, 1).name = "Tatooine"
+    db.session.commit()
+    reload_catalog()
+    changed = client.get("/planets", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert changed.json["results"][0]["name"] == "Tatooine"
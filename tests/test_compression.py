@@ -0,0 +1,32 @@
+import gzip
+
+
+def test_large_pages_are_gzipped_with_a_weak_etag(client, seed_catalog):
+    seed_catalog(20)
+    plain = client.get("/planets")
+    compressed = client.get("/planets", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+
+    for etag in (compressed.headers["ETag"], plain.headers["ETag"]):
+        not_modified = client.get("/planets", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert "Content-Encoding" not in not_modified.headers
+
+
+def test_small_bodies_are_sent_as_they_are(client, seed_catalog):
+    seed_catalog(1)
+    response = client.get("/planets?limit=1&fields=id", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.json["results"] == [{"id": 1}]
+
+
+def test_streamed_exports_are_compressed_chunk_by_chunk(client, seed_catalog):
+    seed_catalog(20)
+    plain = client.get("/export/characters")
+    compressed = client.get("/export/characters", headers={"Accept-Encoding": "gzip"})
+    assert compressed.is_streamed and compressed.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in compressed.headers
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
@@ -0,0 +1,24 @@
+import dataclasses
+import decimal
+from datetime import date, datetime, timezone
+import pytest
+import encoders
+from flask.json.provider import DefaultJSONProvider
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_fast_provider_encodes_like_flask(app, monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(encoders, "orjson", None)
+    elif encoders.orjson is None:
+        pytest.skip("orjson is not installed")
+    value = {"at": datetime(2026, 1, 1, 12, tzinfo=timezone.utc), "day": date(2026, 1, 1),
+             "price": decimal.Decimal("1.50"), "point": Point(3), "name": "Tatooine"}
+    flask_provider = DefaultJSONProvider(app)
+    assert flask_provider.loads(encoders.FastJSONProvider(app).dumps(value)) == flask_provider.loads(flask_provider.dumps(value))
+    assert '"Thu, 01 Jan 2026 12:00:00 GMT"' in encoders.FastJSONProvider(app).dumps(value)
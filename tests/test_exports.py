@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from payload_handlers import update_favorites_lists
+
+
+def favorites_payload(*local_ids):
+    return ([{"category": "PLANET", "planet_id": local_id} for local_id in local_ids]
+            + [{"category": "CHARACTER", "character_id": local_id} for local_id in local_ids])
+
+
+def test_favorites_export_streams_ndjson(client, seed_catalog, user, auth_headers):
+    seed_catalog(3)
+    update_favorites_lists(favorites_payload(1, 3), user.id)
+    response = client.get("/export/favorites", headers=auth_headers)
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["Content-Disposition"] == "attachment; filename=favorites.ndjson"
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted((row["category"], row["id"], row["name"]) for row in rows) == [
+        ("CHARACTER", 1, "Character 1"), ("CHARACTER", 3, "Character 3"), ("PLANET", 1, "Planet 1"), ("PLANET", 3, "Planet 3")]
+    assert {row["user_id"] for row in rows} == {user.id}
+
+
+def test_favorites_are_read_in_batches(db, seed_catalog, user):
+    from exports import favorite_batches
+    seed_catalog(5)
+    update_favorites_lists(favorites_payload(1, 2, 3, 4, 5), user.id)
+    batches = list(favorite_batches(user.id, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+def test_catalog_export_streams_csv(client, seed_catalog):
+    seed_catalog(3)
+    response = client.get("/export/planets?format=csv")
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == "text/csv"
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row["name"] for row in rows] == ["Planet 1", "Planet 2", "Planet 3"]
+    assert rows[0]["terrain"] == "desert"
+
+
+def test_export_rejects_unknown_formats_and_categories(client, db):
+    assert client.get("/export/planets?format=xml").status_code == 400
+    assert client.get("/export/vehicles").status_code == 400
+    assert client.get("/export/favorites").status_code == 401
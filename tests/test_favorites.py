@@ -0,0 +1,76 @@
+from favorites_cache import favorites_cache
+from payload_handlers import update_favorites_lists
+
+
+def planets(*local_ids):
+    return [{"category": "PLANET", "planet_id": local_id} for local_id in local_ids]
+
+
+def test_cached_and_loaded_favorites_are_the_same_body(client, seed_catalog, user, auth_headers):
+    user_id = user.id
+    seed_catalog(5)
+    for payload in (planets(3, 1), planets(4, 1, 2)):
+        written, version = update_favorites_lists(payload, user_id)
+        cached = client.get("/get-favorites", headers=auth_headers)
+        favorites_cache.invalidate(user_id)
+        loaded = client.get("/get-favorites", headers=auth_headers)
+        assert cached.headers["ETag"] == loaded.headers["ETag"] == '"%d"' % version
+        assert cached.get_data() == loaded.get_data()
+        assert [favorite["id"] for favorite in loaded.json] == [favorite["id"] for favorite in written]
+    #* 1 is kept from the first write, 4 and 2 are added after it in payload order
+    assert [favorite["id"] for favorite in written] == [1, 4, 2]
+
+
+def test_stale_if_match_is_a_409_with_the_current_state(client, seed_catalog, user, auth_headers):
+    seed_catalog(5)
+    created = client.post("/update-favorites", json=planets(1, 2), headers={**auth_headers, "If-Match": '"0"'})
+    assert created.status_code == 200 and created.headers["ETag"] == '"1"'
+
+    #* Another client still holding version 0
+    stale = client.post("/update-favorites", json=planets(3), headers={**auth_headers, "If-Match": '"0"'})
+    assert stale.status_code == 409
+    assert stale.json["version"] == 1
+    assert [favorite["id"] for favorite in stale.json["favorites"]] == [1, 2]
+
+    weak = client.post("/update-favorites", json=planets(3), headers={**auth_headers, "If-Match": 'W/"1"'})
+    assert weak.status_code == 200 and weak.headers["ETag"] == '"2"'
+    assert client.post("/update-favorites", json=planets(4), headers={**auth_headers, "If-Match": '"two"'}).status_code == 400
+    assert client.get("/get-favorites", headers=auth_headers).headers["ETag"] == '"2"'
+
+
+def test_unchanged_payload_keeps_the_version(client, seed_catalog, user, auth_headers):
+    seed_catalog(3)
+    client.post("/update-favorites", json=planets(1), headers=auth_headers)
+    again = client.post("/update-favorites", json=planets(1), headers=auth_headers)
+    assert again.status_code == 200 and again.headers["ETag"] == '"1"'
+
+
+def test_patch_applies_the_net_operations(client, seed_catalog, user, auth_headers):
+    seed_catalog(5)
+    client.post("/update-favorites", json=planets(1), headers=auth_headers)
+    client.get("/get-favorites", headers=auth_headers)
+
+    operations = [{"op": "add", "category": "PLANET", "id": 2}, {"op": "add", "category": "CHARACTER", "id": 3},
+                  {"op": "remove", "category": "PLANET", "id": 1}, {"op": "add", "category": "PLANET", "id": 4},
+                  {"op": "remove", "category": "PLANET", "id": 4}, {"op": "add", "category": "PLANET", "id": 99}]
+    response = client.patch("/favorites", json=operations, headers={**auth_headers, "If-Match": '"1"'})
+    assert response.status_code == 200 and response.headers["ETag"] == '"2"'
+    assert response.json["added"] == [{"category": "PLANET", "id": 2, "name": "Planet 2"},
+                                      {"category": "CHARACTER", "id": 3, "name": "Character 3"}]
+    assert response.json["removed"] == [{"category": "PLANET", "id": 1}]
+
+    #* The cached state of version 1 was replaced
+    favorites = client.get("/get-favorites", headers=auth_headers)
+    assert favorites.headers["ETag"] == '"2"'
+    assert favorites.json == [{"id": 3, "name": "Character 3"}, {"id": 2, "name": "Planet 2"}]
+
+
+def test_patch_without_changes_keeps_the_version(client, seed_catalog, user, auth_headers):
+    seed_catalog(3)
+    client.post("/update-favorites", json=planets(1), headers=auth_headers)
+    operations = [{"op": "add", "category": "PLANET", "id": 1}, {"op": "remove", "category": "CHARACTER", "id": 2}]
+    response = client.patch("/favorites", json=operations, headers=auth_headers)
+    assert response.status_code == 200 and response.headers["ETag"] == '"1"'
+    assert response.json == {"added": [], "removed": [], "version": 1}
+    assert client.patch("/favorites", json=[{"op": "toggle", "category": "PLANET", "id": 1}], headers=auth_headers).status_code == 400
+    assert client.patch("/favorites", json=operations, headers={**auth_headers, "If-Match": '"0"'}).status_code == 409
@@ -0,0 +1,42 @@
+from favorites_cache import FavoritesCache, MemoryBackend
+
+
+def state(version, favorites):
+    return {"version": version, "updated_at": None, "favorites": favorites}
+
+
+def test_a_load_older_than_a_write_is_not_cached():
+    cache = FavoritesCache(MemoryBackend())
+
+    def load_then_write():
+        #* The miss read version 0, a write commits and stores version 1 before the load is stored
+        cache.store(7, state(1, [{"id": 1, "name": "Tatooine"}]))
+        return state(0, [])
+
+    assert cache.get_or_load(7, load_then_write)["version"] == 0
+    assert cache.get_or_load(7, lambda: state(2, []))["version"] == 1
+
+
+def test_invalidate_with_a_version_rejects_older_loads():
+    cache = FavoritesCache(MemoryBackend())
+    cache.store(7, state(1, []))
+    cache.invalidate(7, version=2)
+
+    #* The marker is a miss, an older load goes back to the client without being cached
+    assert cache.get_or_load(7, lambda: state(1, []))["version"] == 1
+    assert cache.get_or_load(7, lambda: state(2, [{"id": 3, "name": "Hoth"}]))["favorites"] == [{"id": 3, "name": "Hoth"}]
+    assert cache.get_or_load(7, lambda: state(9, []))["version"] == 2
+    assert cache.hits == 1
+
+
+def test_get_favorites_after_patch_serves_the_new_version(client, seed_catalog, user, auth_headers):
+    seed_catalog(3)
+    first = client.get("/get-favorites", headers=auth_headers)
+    assert first.headers["ETag"] == '"0"'
+
+    response = client.patch("/favorites", json=[{"op": "add", "category": "PLANET", "id": 2}], headers=auth_headers)
+    assert response.status_code == 200
+
+    second = client.get("/get-favorites", headers=auth_headers)
+    assert second.headers["ETag"] == '"1"'
+    assert second.get_json() == [{"id": 2, "name": "Planet 2"}]
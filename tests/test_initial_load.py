@@ -0,0 +1,49 @@
+import json
+import pytest
+import sql_helpers
+from sqlalchemy import func, select
+from initialLoad import initial_loader, FixtureSource
+
+
+def planet(local_id, name, climate="arid"):
+    return {"url": "https://swapi.dev/api/planets/%d/" % local_id, "name": name, "climate": climate, "population": "1000",
+            "terrain": "desert", "rotation_period": "23", "orbital_period": "304", "diameter": "10465", "surface_water": "1"}
+
+
+def person(local_id, name, homeworld=1):
+    return {"url": "https://swapi.dev/api/people/%d/" % local_id, "name": name, "birth_year": "19BBY", "gender": "male",
+            "height": "172", "skin_color": "fair", "eye_color": "blue", "hair_color": "blond",
+            "homeworld": "https://swapi.dev/api/planets/%d/" % homeworld}
+
+
+def write_fixtures(directory, planets, people):
+    #* Two planet pages and one people page, the loader reads count from the first one
+    for resource, items in (("planets", planets), ("people", people)):
+        pages = [items[:2], items[2:]] if len(items) > 2 else [items]
+        for page, results in enumerate(pages, start=1):
+            (directory / ("%s-%d.json" % (resource, page))).write_text(json.dumps({"count": len(items), "results": results}))
+
+
+@pytest.mark.parametrize("generic", [False, True], ids=["on_conflict", "generic_fallback"])
+def test_a_second_load_updates_the_rows_in_place(db, tmp_path, monkeypatch, generic):
+    from models import Planet, Character
+    if generic:
+        monkeypatch.setattr(sql_helpers, "dialect_insert", lambda table, dialect_name: None)
+
+    write_fixtures(tmp_path, [planet(1, "Tatooine"), planet(2, "Alderaan"), planet(3, "Yavin IV")],
+                   [person(1, "Luke Skywalker"), person(4, "Darth Vader")])
+    stats = initial_loader(FixtureSource(str(tmp_path)))
+    assert stats.to_dict() == {"pages_fetched": 3, "rows_upserted": 5}
+    planet_ids = dict(db.session.execute(select(Planet.local_id, Planet.id)).all())
+
+    write_fixtures(tmp_path, [planet(1, "Tatooine", climate="scorching"), planet(2, "Alderaan"), planet(3, "Yavin IV"),
+                              planet(5, "Hoth")],
+                   [person(1, "Luke Skywalker"), person(4, "Anakin Skywalker")])
+    initial_loader(FixtureSource(str(tmp_path)))
+    db.session.expire_all()
+
+    assert db.session.scalar(select(func.count()).select_from(Planet)) == 4
+    assert db.session.scalar(select(func.count()).select_from(Character)) == 2
+    tatooine = db.session.execute(select(Planet).where(Planet.local_id == 1)).scalar_one()
+    assert tatooine.climate == "scorching" and tatooine.id == planet_ids[1]
+    assert db.session.execute(select(Character.name).where(Character.local_id == 4)).scalar_one() == "Anakin Skywalker"
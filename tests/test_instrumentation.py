@@ -0,0 +1,16 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from instrumentation import metrics
+
+
+def test_failed_statements_are_counted_and_do_not_leak_start_times(app, db, client):
+    errors = dict(metrics._counters).get(("sql_statement_errors_total", (("endpoint", "none"),)), 0)
+    with db.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        assert conn.info["query_start_time"] == []
+        conn.execute(text("SELECT 1"))
+        assert conn.info["query_start_time"] == []
+    assert metrics._counters[("sql_statement_errors_total", (("endpoint", "none"),))] == errors + 3
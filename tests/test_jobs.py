@@ -0,0 +1,101 @@
+import threading
+import time
+from initialLoad import LoadStats
+from jobs import JobRunner
+
+
+def wait_for(runner, job_id, status, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job %s never reached %s: %s" % (job_id, status, job))
+
+
+def test_jobs_are_shared_by_every_worker(app, db):
+    release = threading.Event()
+
+    def target(stats):
+        stats.rows_written(3)
+        release.wait(5)
+
+    worker = JobRunner("test_job", target, LoadStats)
+    #* A second runner of the same kind stands for another gunicorn worker, it shares nothing but the database
+    other_worker = JobRunner("test_job", target, LoadStats)
+
+    job, created = worker.submit(app)
+    assert created
+    running = wait_for(other_worker, job["id"], "running")
+    assert running["rows_upserted"] == 0
+
+    active, created = other_worker.submit(app)
+    assert not created and active["id"] == job["id"]
+
+    release.set()
+    finished = wait_for(other_worker, job["id"], "succeeded")
+    assert finished["rows_upserted"] == 3
+    assert other_worker.get("unknown") is None
+
+    job, created = other_worker.submit(app)
+    assert created
+    wait_for(worker, job["id"], "succeeded")
+
+
+def test_a_failed_job_releases_the_lock(app, db):
+    def target(stats):
+        raise ValueError("boom")
+
+    runner = JobRunner("failing_job", target, LoadStats)
+    job, created = runner.submit(app)
+    failed = wait_for(runner, job["id"], "failed")
+    assert failed["errors"] == ["ValueError: boom"]
+    assert runner.submit(app)[1]
+
+
+def test_running_jobs_publish_their_progress_and_are_never_taken_over(app, db, monkeypatch):
+    import jobs
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.02)
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 1)
+    release = threading.Event()
+
+    def target(stats):
+        stats.rows_written(5)
+        release.wait(5)
+
+    worker = JobRunner("heartbeat_job", target, LoadStats)
+    other_worker = JobRunner("heartbeat_job", target, LoadStats)
+    job, created = worker.submit(app)
+    try:
+        deadline = time.time() + 5
+        while other_worker.get(job["id"]).get("rows_upserted") != 5:
+            assert time.time() < deadline, "the progress was never published"
+            time.sleep(0.01)
+
+        #* Older than JOB_STALE_SECONDS, but the heartbeat keeps it alive
+        time.sleep(1.2)
+        active, created = other_worker.submit(app)
+        assert not created and active["id"] == job["id"]
+    finally:
+        release.set()
+    wait_for(other_worker, job["id"], "succeeded")
+
+
+def test_a_job_without_heartbeat_is_taken_over(app, db, monkeypatch):
+    import jobs
+    from datetime import timedelta
+    from models import BackgroundJob
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 60)
+    long_ago = jobs.utc_now() - timedelta(seconds=120)
+    #* The row a worker that died left behind
+    db.session.add(BackgroundJob(id="dead", kind="orphan_job", status="running", lock_key="orphan_job",
+                                 created_at=long_ago, updated_at=long_ago))
+    db.session.commit()
+
+    runner = JobRunner("orphan_job", lambda stats: None, LoadStats)
+    job, created = runner.submit(app)
+    assert created
+    wait_for(runner, job["id"], "succeeded")
+    abandoned = runner.get("dead")
+    assert abandoned["status"] == "failed" and abandoned["errors"] == ["Abandoned, the worker running it stopped"]
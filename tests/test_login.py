@@ -0,0 +1,42 @@
+import json
+import pytest
+import rate_limit
+import passwords
+
+
+def test_unknown_username_costs_a_password_verification(client, user, monkeypatch):
+    verified = []
+    verify_password = passwords.verify_password
+    monkeypatch.setattr(passwords, "verify_password", lambda stored, password: verified.append(stored) or verify_password(stored, password))
+
+    response = client.post("/login", json={"username": "nobody", "password": "correct horse"})
+    assert response.status_code == 401
+    assert verified == [passwords.dummy_password_hash()]
+    assert passwords.hash_method(verified[0]) == passwords.normalized_method(passwords.PASSWORD_HASH_METHOD)
+
+    response = client.post("/login", json={"username": "luke", "password": "wrong"})
+    assert response.status_code == 401
+    assert len(verified) == 2 and verified[1] == user.password
+
+
+def test_login_returns_a_token(client, user):
+    response = client.post("/login", json={"username": "luke", "password": "correct horse"})
+    assert response.status_code == 200
+    assert response.get_json()["access_token"]
+
+
+@pytest.mark.parametrize("body", [None, [], {"username": "luke"}, {"username": "luke", "password": 123},
+                                  {"username": ["luke"], "password": "correct horse"}, {"username": "luke", "password": ""}])
+def test_login_rejects_malformed_bodies(client, user, body):
+    rate_limit.bucket_store.clear()
+    response = client.post("/login", data=json.dumps(body), content_type="application/json")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", [None, "luke", {"username": "han", "email": "han@example.com", "password": 123},
+                                  {"username": 7, "email": "han@example.com", "password": "falcon"},
+                                  {"username": "han", "email": None, "password": "falcon"}])
+def test_create_account_rejects_malformed_bodies(client, db, body):
+    rate_limit.bucket_store.clear()
+    response = client.post("/create-account", data=json.dumps(body), content_type="application/json")
+    assert response.status_code == 400
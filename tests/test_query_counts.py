@@ -0,0 +1,56 @@
+"""Statement counts of the favorites paths, pinned with sql_helpers.assert_num_queries."""
+import pytest
+from sql_helpers import assert_num_queries
+
+
+def favorites_payload(count, first=1):
+    local_ids = range(first, first + count)
+    return ([{"category": "PLANET", "planet_id": local_id} for local_id in local_ids]
+            + [{"category": "CHARACTER", "character_id": local_id} for local_id in local_ids])
+
+
+def test_merged_favorites_are_one_union_all(db, seed_catalog, user):
+    from payload_handlers import get_merged_lists, update_favorites_lists
+    user_id = user.id
+    seed_catalog(20)
+    update_favorites_lists(favorites_payload(20), user_id)
+
+    with assert_num_queries(1) as counter:
+        merged = get_merged_lists(user_id)
+    assert "UNION ALL" in counter.statements[0]
+    assert len(merged) == 40
+
+
+def test_get_favorites_cache_miss_reads_version_and_union(client, seed_catalog, user, auth_headers):
+    from payload_handlers import update_favorites_lists
+    from favorites_cache import favorites_cache
+    seed_catalog(5)
+    update_favorites_lists(favorites_payload(5), user.id)
+    favorites_cache.invalidate(user.id)
+
+    #* The is_active check of the token, the version row and the favorites UNION ALL
+    with assert_num_queries(3) as counter:
+        response = client.get("/get-favorites", headers=auth_headers)
+    assert response.status_code == 200
+    assert sum("UNION ALL" in statement for statement in counter.statements) == 1
+
+    #* Served from the write through cache, the is_active check is cached too
+    with assert_num_queries(0):
+        assert client.get("/get-favorites", headers=auth_headers).status_code == 200
+
+
+@pytest.mark.parametrize("count", [1, 10, 400])
+def test_update_favorites_statement_count_does_not_grow_with_the_payload(db, seed_catalog, user, count):
+    from payload_handlers import update_favorites_lists
+    user_id = user.id
+    seed_catalog(401)
+
+    #* Version bump and its read back, then per category one SELECT of the stored ids and one bulk INSERT
+    with assert_num_queries(6):
+        favorites, version = update_favorites_lists(favorites_payload(count), user_id)
+    assert len(favorites) == 2 * count
+    assert version == 1
+
+    #* Dropping the first id and adding the next one adds one bulk DELETE per category
+    with assert_num_queries(8):
+        update_favorites_lists(favorites_payload(count, first=2), user_id)
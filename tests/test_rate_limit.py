@@ -0,0 +1,25 @@
+import pytest
+import rate_limit
+from utils import APIException
+
+
+def test_spoofed_forwarded_for_entries_are_ignored(app, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUSTED_PROXIES", 1)
+    monkeypatch.setenv("RATE_LIMIT_LOGIN", "2/minute")
+    login = rate_limit.limited("login", rate="20/minute", per="ip")(lambda: "ok")
+    rate_limit.bucket_store.clear()
+
+    def call(forwarded_for):
+        #* The proxy appends the address it got the request from, the client controls everything before it
+        with app.test_request_context("/login", method="POST", headers={"X-Forwarded-For": forwarded_for},
+                                      environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+            assert rate_limit.client_ip() == forwarded_for.rsplit(", ", 1)[-1]
+            return login()
+
+    assert call("1.1.1.1, 203.0.113.7") == "ok"
+    assert call("2.2.2.2, 203.0.113.7") == "ok"
+    with pytest.raises(APIException) as error:
+        call("3.3.3.3, 203.0.113.7")
+    assert error.value.status_code == 429
+    assert call("203.0.113.8") == "ok"
+    rate_limit.bucket_store.clear()
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def galaxy(db):
+    from models import Planet, Character
+    from catalog import reload_catalog
+    db.session.add_all([
+        Planet(local_id=1, name="Tatooine", climate="arid", terrain="desert"),
+        Planet(local_id=2, name="Desert Rock", climate="arid", terrain="rock"),
+        Planet(local_id=3, name="Hoth", climate="frozen", terrain="tundra, ice caves"),
+        Planet(local_id=4, name="Deserta", climate="temperate", terrain="plains"),
+        Character(local_id=1, name="Luke Skywalker", gender="male", eye_color="blue"),
+        Character(local_id=2, name="Anakin Skywalker", gender="male", eye_color="blue"),
+        Character(local_id=3, name="Leia Organa", gender="female", eye_color="brown"),
+    ])
+    db.session.commit()
+    reload_catalog()
+
+
+def names(response):
+    return [result["name"] for result in response.json["results"]]
+
+
+def test_name_matches_rank_above_other_fields_and_prefixes(client, galaxy):
+    #* Whole word in the name, then a prefix of a name, then the terrain
+    assert names(client.get("/search?q=desert")) == ["Desert Rock", "Deserta", "Tatooine"]
+    response = client.get("/search?q=desert&limit=1")
+    assert response.json["q"] == "desert"
+    assert response.json["results"] == [{"type": "planets", "local_id": 2, "name": "Desert Rock", "score": 3.0}]
+
+
+def test_every_word_has_to_match(client, galaxy):
+    assert names(client.get("/search?q=sky%20luk")) == ["Luke Skywalker"]
+    #* Same score, the name breaks the tie
+    assert names(client.get("/search?q=skywalker")) == ["Anakin Skywalker", "Luke Skywalker"]
+    assert names(client.get("/search?q=blue%20female")) == []
+    assert names(client.get("/search?q=ice&type=characters")) == []
+    assert names(client.get("/search?q=ice&type=planets")) == ["Hoth"]
+
+
+def test_the_index_follows_the_catalog(client, db, galaxy):
+    from models import Planet
+    from catalog import reload_catalog
+    etag = client.get("/search?q=hoth").headers["ETag"]
+    db.session.get(Planet, 3).name = "Echo Base"
+    db.session.commit()
+    reload_catalog()
+    response = client.get("/search?q=hoth", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and names(response) == []
+    assert names(client.get("/search?q=echo")) == ["Echo Base"]
+
+
+@pytest.mark.parametrize("query", ["", "q=", "q=%20!!", "q=hoth&type=vehicles", "q=hoth&limit=0"])
+def test_invalid_searches_are_400(client, galaxy, query):
+    assert client.get("/search?" + query).status_code == 400
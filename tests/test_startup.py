@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+from conftest import SRC_DIR
+
+CHECK_IMPORTS = """
+import sys
+from main import create_app
+create_app({"ENABLE_ADMIN": False, "ENABLE_LOADER": False, "ENABLE_MIGRATE": False, "PRELOAD_CATALOG": False})
+print(",".join(sorted(name for name in ("initialLoad", "requests", "urllib3", "flask_admin", "flask_migrate") if name in sys.modules)))
+"""
+
+
+def test_disabled_components_are_not_imported():
+    #* A new interpreter, the test session itself imports everything
+    result = subprocess.run([sys.executable, "-c", CHECK_IMPORTS], cwd=SRC_DIR, env=dict(os.environ),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""